@@ -4,7 +4,9 @@
 # Copyright (C) 2014 Peter Wu <peter@lekensteyn.nl>
 
 import struct
+from array import array
 from collections import namedtuple
+import itertools
 import logging
 
 _logger = logging.getLogger(__name__)
@@ -65,6 +67,101 @@ class Format(object):
         # struct is passes the specification, save it!
         self.struct = new_struct
         self.factory = namedtuple(self.label, ' '.join(self.names))
+        self._compile()
+
+    def _compile(self):
+        """
+        Generates the unpack and pack functions of this format, with the
+        conversions and checks of every field as straight-line code. They do
+        the same as unpack_field and pack_field for every field.
+        """
+        namespace = {
+            'struct_unpack': self.struct.unpack,
+            'struct_pack': self.struct.pack,
+            'pack_uint32': struct.Struct('!I').pack,
+            'from_bytes': int.from_bytes,
+            'make': self.factory._make,
+            '_logger': _logger,
+        }
+        variables = ['v{0}'.format(i) for i in range(len(self.names))]
+
+        def unpack_source(function_name, validate, from_row=False):
+            if from_row:
+                # Converts a tuple of struct.iter_unpack
+                lines = ['def {0}(row):'.format(function_name),
+                         '    {0}, = row'.format(', '.join(variables))]
+            else:
+                lines = ['def {0}(data):'.format(function_name),
+                         '    {0}, = struct_unpack(data)'.format(', '.join(variables))]
+            for i, (name, v) in enumerate(zip(self.names, variables)):
+                if name in self.int3s:
+                    lines.append('    {0} = from_bytes({0}, "big")'.format(v))
+                if validate and name in self.literals:
+                    namespace['literal{0}'.format(i)] = self.literals[name]
+                    lines.append('    if literal{1} != {0}:'.format(v, i))
+                    lines.append("        raise RuntimeError('Literal mismatch: "
+                        "{{0}} != {{1}}'.format(repr(literal{1}), {0}))".format(v, i))
+                if validate and name in self.valid_values:
+                    namespace['valid{0}'.format(i)] = self.valid_values[name]
+                    namespace['garbage{0}'.format(i)] = \
+                        'Garbage value found for {0}.{1}: {{0}}'.format(self.label, name)
+                    lines.append('    if not {0} in valid{1}:'.format(v, i))
+                    lines.append('        _logger.info(garbage{1}.format({0}))'.format(v, i))
+                if name in self.value_types:
+                    value_type = self.value_types[name]
+                    if _is_scaled(value_type, 'decode'):
+                        namespace['factor{0}'.format(i)] = value_type._factor
+                        lines.append('    {0} = {0} / factor{1}'.format(v, i))
+                    else:
+                        namespace['decode{0}'.format(i)] = value_type.decode
+                        lines.append('    {0} = decode{1}({0})'.format(v, i))
+            lines.append('    return make(({0},))'.format(', '.join(variables)))
+            return '\n'.join(lines) + '\n'
+
+        def pack_source():
+            lines = ['def pack(t):',
+                     '    if isinstance(t, dict):']
+            lines += ['        {0} = t[{1!r}]'.format(v, name)
+                      for name, v in zip(self.names, variables)]
+            lines.append('    else:')
+            lines += ['        {0} = t.{1}'.format(v, name)
+                      for name, v in zip(self.names, variables)]
+            for i, (name, v) in enumerate(zip(self.names, variables)):
+                if name in self.value_types:
+                    value_type = self.value_types[name]
+                    if _is_scaled(value_type, 'encode'):
+                        namespace['factor{0}'.format(i)] = value_type._factor
+                        lines.append('    {0} = int({0} * factor{1})'.format(v, i))
+                    else:
+                        namespace['encode{0}'.format(i)] = value_type.encode
+                        lines.append('    {0} = encode{1}({0})'.format(v, i))
+                # Literals must match exactly, ignore given value
+                if name in self.literals:
+                    namespace['literal{0}'.format(i)] = self.literals[name]
+                    lines.append('    {0} = literal{1}'.format(v, i))
+                else:
+                    lines.append('    {0} = int({0})'.format(v))
+                if name in self.valid_values:
+                    namespace['valid{0}'.format(i)] = self.valid_values[name]
+                    namespace['invalid{0}'.format(i)] = \
+                        'Invalid value {{0}} for name {0}'.format(name)
+                    lines.append('    if not {0} in valid{1}:'.format(v, i))
+                    lines.append('        _logger.warn(invalid{1}.format({0}))'.format(v, i))
+                if name in self.int3s:
+                    lines.append('    {0} = pack_uint32({0})[-3:]'.format(v))
+            lines.append('    return struct_pack({0})'.format(', '.join(variables)))
+            return '\n'.join(lines) + '\n'
+
+        exec(unpack_source('unpack_checked', True), namespace)
+        exec(unpack_source('unpack', False), namespace)
+        exec(unpack_source('convert_checked', True, from_row=True), namespace)
+        exec(unpack_source('convert', False, from_row=True), namespace)
+        exec(pack_source(), namespace)
+        self._unpack_checked = namespace['unpack_checked']
+        self._unpack = namespace['unpack']
+        self._convert_checked = namespace['convert_checked']
+        self._convert = namespace['convert']
+        self._pack = namespace['pack']
 
     def unitify(self, name, value):
         if not self.struct:
@@ -132,13 +229,9 @@ class Format(object):
         """
         if not self.struct:
             raise RuntimeError('Not initialized yet')
-
-        res = self.struct.unpack(data)
-        unpacked_bytes = []
-        for name, val in zip(self.names, res):
-            unpacked_bytes.append(self.unpack_field(name, val, validate))
-
-        return self.factory._make(unpacked_bytes)
+        if validate:
+            return self._unpack_checked(data)
+        return self._unpack(data)
 
     def pack(self, t):
         """
@@ -146,16 +239,108 @@ class Format(object):
         """
         if not self.struct:
             raise RuntimeError('Not initialized yet')
+        return self._pack(t)
 
-        vals = []
-        for name in self.names:
-            if isinstance(t, dict):
-                val = t[name]
-            else:
-                val = getattr(t, name)
-            vals.append(self.pack_field(name, val))
+    def iter_unpack(self, data, validate=True):
+        """
+        Interprets contiguous records in data (any bytes-like object with a
+        multiple of size() bytes) one at a time, like unpack.
+        """
+        if not self.struct:
+            raise RuntimeError('Not initialized yet')
+        convert = self._convert_checked if validate else self._convert
+        return map(convert, self.struct.iter_unpack(data))
 
-        return self.struct.pack(*vals)
+    def unpack_many(self, data, validate=True):
+        """Same as iter_unpack, but returns a list of named tuples."""
+        return list(self.iter_unpack(data, validate))
+
+    def unpack_columns(self, data, validate=True):
+        """
+        Interprets contiguous records in data into a tuple with one column per
+        field. Conversions are applied to whole columns: fields of a Float10
+        type become arrays of floats, other numbers arrays of ints. Garbage
+        values are logged as a count per field.
+        """
+        if not self.struct:
+            raise RuntimeError('Not initialized yet')
+        raw_columns = list(zip(*self.struct.iter_unpack(data))) or \
+            [()] * len(self.names)
+        columns = []
+        for name, values in zip(self.names, raw_columns):
+            if name in self.int3s:
+                values = [int.from_bytes(val, 'big') for val in values]
+            if validate:
+                self._check_column(name, values)
+            columns.append(self._decode_column(name, values))
+        return tuple(columns)
+
+    def _check_column(self, name, values):
+        if name in self.literals:
+            literal = self.literals[name]
+            for val in values:
+                if literal != val:
+                    raise RuntimeError('Literal mismatch: {0} != {1}'
+                        .format(repr(literal), val))
+        if name in self.valid_values and _logger.isEnabledFor(logging.INFO):
+            valid = self.valid_values[name]
+            count = sum(1 for val in values if not val in valid)
+            if count:
+                _logger.info('Garbage values found for {0}.{1}: {2} records'
+                    .format(self.label, name, count))
+
+    def _decode_column(self, name, values):
+        value_type = self.value_types.get(name)
+        if value_type and _is_scaled(value_type, 'decode'):
+            # Same as value / factor for every value
+            return array('d', map(value_type._factor.__rtruediv__, values))
+        if value_type:
+            return list(map(value_type.decode, values))
+        if name in self.literals:
+            return list(values)
+        return array('q', values)
+
+    def pack_many(self, records):
+        """Formats named tuples or dicts like pack into contiguous records."""
+        if not self.struct:
+            raise RuntimeError('Not initialized yet')
+        return b''.join(map(self._pack, records))
+
+    def pack_columns(self, columns):
+        """
+        Formats one column per field (like returned by unpack_columns) into
+        contiguous records, converting whole columns at once. Values of
+        literals are ignored. Invalid values are logged as a count per field.
+        """
+        if not self.struct:
+            raise RuntimeError('Not initialized yet')
+        count = len(columns[0]) if columns else 0
+        encoded = [self._encode_column(name, values, count)
+                   for name, values in zip(self.names, columns)]
+        return b''.join(itertools.starmap(self.struct.pack, zip(*encoded)))
+
+    def _encode_column(self, name, values, count):
+        # Literals must match exactly, ignore given values
+        if name in self.literals:
+            return [self.literals[name]] * count
+        value_type = self.value_types.get(name)
+        if value_type and _is_scaled(value_type, 'encode'):
+            # Same as int(value * factor) for every value
+            values = list(map(int, map(value_type._factor.__mul__, values)))
+        elif value_type:
+            values = [int(value_type.encode(val)) for val in values]
+        else:
+            values = list(map(int, values))
+        if name in self.valid_values:
+            valid = self.valid_values[name]
+            invalid = sum(1 for val in values if not val in valid)
+            if invalid:
+                _logger.warn('Invalid values for name {0}: {1} records'
+                    .format(name, invalid))
+        if name in self.int3s:
+            pack_uint32 = struct.Struct('!I').pack
+            values = [pack_uint32(val)[-3:] for val in values]
+        return values
 
     def parse_from_file(self, f):
         data = f.read(self.size())
@@ -170,6 +355,11 @@ class Format(object):
             raise RuntimeError('Not initialized yet')
         return self.struct.size
 
+def _is_scaled(value_type, method):
+    """Whether method of value_type is the one of Float10 (with any factor)."""
+    return getattr(getattr(value_type, method), '__func__', None) is \
+        getattr(Float10, method).__func__
+
 # Types that reinterprets data for display.
 # decode: file -> display; encode: display -> file
 class Float10(object):
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+# Generator of synthetic SD card dumps: an info file, data files and a setup
+# file, like the logger writes them. The files are packed with the Formats of
+# defs.py, so they can be processed by el4000.py and report.py.
+#
+# Run from the repository root:
+#   python3 -m benchmarks.dump_generator [options] <output directory>
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+import math
+import os
+import random
+
+from defs import info, data, data_hdr, setup, STARTCODE
+from pkg.data_decoder import EOF_CODE
+
+# Effective power over time, see _load
+LOAD_PATTERNS = ["idle", "constant", "daily", "appliance", "random"]
+
+SETUP_FILENAME = "setupel3.bin"
+
+
+def _load(pattern: str, rng: random.Random):
+    """Returns a function from minute to effective power for pattern."""
+    if pattern == "idle":
+        return lambda minute: rng.uniform(0, 2)
+    if pattern == "constant":
+        return lambda minute: rng.gauss(100, 2)
+    if pattern == "daily":
+        # Low at night, peak in the afternoon
+        return lambda minute: 40 + 400 * max(0.0, math.sin(
+            (minute % 1440 - 360) / 1440 * 2 * math.pi)) + rng.uniform(0, 20)
+    if pattern == "appliance":
+        # Like a fridge: 80 W for 20 minutes of every 65, idle otherwise
+        return lambda minute: rng.gauss(80, 3) if minute % 65 < 20 else rng.uniform(0, 2)
+    if pattern == "random":
+        return lambda minute: rng.uniform(0, 800)
+    raise ValueError("Unknown load pattern: " + pattern)
+
+
+def _record(rng: random.Random, power: float) -> tuple:
+    """Returns raw (voltage, current, power_factor) values of data."""
+    voltage = rng.randint(2250, 2350)
+    power_factor = rng.randint(90, 99) if power > 10 else rng.randint(10, 50)
+    current = int(max(0.0, power) * 1000 * 1000 / (voltage * power_factor))
+    return voltage, min(current, 3999), power_factor
+
+
+def _header(date: datetime) -> bytes:
+    return data_hdr.pack({
+        "startcode": STARTCODE,
+        "record_month": date.month,
+        "record_day": date.day,
+        "record_year": date.year - 2000,
+        "record_hour": date.hour,
+        "record_minute": date.minute
+    })
+
+
+def generate_dump(dir: str, start: datetime, minutes: int,
+                  records_per_file: int = 7 * 1440, header_every: int = 1440,
+                  gap_probability: float = 0.0, max_gap_minutes: int = 240,
+                  load: str = "appliance", unit_id: int = 0, seed: int = 1,
+                  with_setup: bool = True) -> int:
+    """
+    Writes a dump with minutes records from datetime start into dir. Every data
+    file holds up to records_per_file records. Each but the earliest file
+    starts with a header, and a header is repeated every header_every records
+    within a file. At every header, recording stops for up to max_gap_minutes
+    with gap_probability (like when the logger is unplugged).
+    File names sort like the ones of the logger: the info file first, then the
+    data files from the latest to the earliest.
+    Returns the number of records written.
+    """
+    rng = random.Random(seed)
+    power_at = _load(load, rng)
+    os.makedirs(dir, exist_ok=True)
+    letter = "ABCDEFGHIJ"[unit_id]
+    file_count = max(1, math.ceil(minutes / records_per_file))
+
+    date = start
+    written = 0
+    energy_wh = 0.0
+    for i in range(file_count):
+        parts = []
+        count = min(records_per_file, minutes - written)
+        for j in range(count):
+            if (i > 0 and j == 0) or (j > 0 and j % header_every == 0):
+                if rng.random() < gap_probability:
+                    date += timedelta(minutes=rng.randint(1, max_gap_minutes))
+                parts.append(_header(date))
+            voltage, current, power_factor = _record(rng, power_at(written + j))
+            energy_wh += voltage * current * power_factor / 1e6 / 60
+            # Records are packed with the struct of data from raw values, the
+            # float conversions of data.pack are not needed here.
+            parts.append(data.struct.pack(voltage, current, power_factor))
+            date += timedelta(minutes=1)
+        parts.append(EOF_CODE)
+        written += count
+        filename = "{}{:07X}.BIN".format(letter, file_count - i)
+        with open(os.path.join(dir, filename), 'wb') as file:
+            file.write(b''.join(parts))
+
+    values = {name: 0 for name in info.names}
+    values.update({
+        "total_power_consumption": min(energy_wh / 1000, 16777.215),
+        "total_recorded_time": min(written / 60, 167772.15),
+        "unit_id": unit_id,
+        "tariff1": 0.221,
+        "tariff2": 0.227,
+        "init_time_hour": start.hour,
+        "init_time_minute": start.minute,
+        "init_date_month": start.month,
+        "init_date_day": start.day,
+        "init_date_year": start.year - 2000
+    })
+    with open(os.path.join(dir, "{}{:07X}.BIN".format(letter, 0)), 'wb') as file:
+        file.write(info.pack(values))
+
+    if with_setup:
+        with open(os.path.join(dir, SETUP_FILENAME), 'wb') as file:
+            file.write(setup.pack({
+                "header_magic": None,
+                "unit_id": unit_id,
+                "hour_format": 2,
+                "date_format": 2,
+                "time_hour": start.hour,
+                "time_minute": start.minute,
+                "date_month": start.month,
+                "date_day": start.day,
+                "date_year": start.year - 2000,
+                "currency": 8,
+                "tariff1": 0.221,
+                "tariff2": 0.227
+            }))
+    return written
+
+
+parser = ArgumentParser(description='Generate a synthetic Energy Logger 4000 SD card dump')
+parser.add_argument('--start', default='2021-01-01 00:00',
+                    help="date of the first record (default '%(default)s')")
+parser.add_argument('--days', type=float, default=365,
+                    help='time span of the records in days (default %(default)s)')
+parser.add_argument('--records-per-file', type=int, default=7 * 1440,
+                    help='maximum number of records per data file (default %(default)s)')
+parser.add_argument('--header-every', type=int, default=1440,
+                    help='number of records between headers within a data file \
+                    (default %(default)s)')
+parser.add_argument('--gap-probability', type=float, default=0.0,
+                    help='probability of a gap in the records at a header \
+                    (default %(default)s)')
+parser.add_argument('--max-gap', type=int, default=240,
+                    help='maximum length of a gap in minutes (default %(default)s)')
+parser.add_argument('--load', choices=LOAD_PATTERNS, default='appliance',
+                    help="load pattern (default '%(default)s')")
+parser.add_argument('--unit-id', type=int, choices=range(0, 9), default=0,
+                    help='unit id of the logger (default %(default)s)')
+parser.add_argument('--seed', type=int, default=1,
+                    help='seed of the random values (default %(default)s)')
+parser.add_argument('--no-setup', action='store_true',
+                    help='do not write a {} file'.format(SETUP_FILENAME))
+parser.add_argument('dir', help='output directory')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    records = generate_dump(args.dir, datetime.strptime(args.start, '%Y-%m-%d %H:%M'),
+                            int(args.days * 1440), args.records_per_file,
+                            args.header_every, args.gap_probability, args.max_gap,
+                            args.load, args.unit_id, args.seed, not args.no_setup)
+    print("{} records written to {}".format(records, args.dir))
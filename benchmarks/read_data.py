@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Benchmark of report.read_data: rows/sec of the line by line CSV parser it
+# used to have, the block based CSV parser and the columnar file.
+#
+# Run from the repository root: python3 -m benchmarks.read_data [rows]
+
+from argparse import ArgumentParser
+from datetime import datetime
+import os
+import random
+import tempfile
+import time
+
+from pkg import all_data_file, columnar_file, record_table
+from pkg.record_table import RecordTable
+import report
+
+
+def write_csv(path: str, rows: int, seed: int = 1):
+    rng = random.Random(seed)
+    records = RecordTable()
+    start = record_table.parse_date("2021-01-01 00:00")
+    with open(path, "w") as file:
+        file.write(all_data_file.expected_header_line)
+        for minute in range(start, start + rows):
+            voltage = rng.randint(2200, 2450) / 10.0
+            current = rng.randint(0, 3000) / 1000.0
+            power_factor = rng.randint(0, 99) / 100.0
+            record = [minute, voltage, current, power_factor,
+                      voltage * current, voltage * current * power_factor]
+            records.append(record)
+            file.write(all_data_file.format_line(
+                record_table.format_date(minute), *record[1:]))
+    return records
+
+
+def read_csv_data_by_line(data_file_path: str):
+    """The line by line parser of report.read_data, as a baseline."""
+    with open(data_file_path) as file:
+        header = file.readline()
+        if not header == all_data_file.expected_header_line:
+            raise Exception("Invalid header in data file: " + header)
+
+        records = RecordTable()
+        for line in file:
+            fields = line.strip().split(",")
+            if len(fields) != 6:
+                raise Exception("Invalid number of fields in data: " + len(fields))
+
+            record = [None] * len(all_data_file.EXPECTED_DATA_FIELDS)
+            record[all_data_file.i_date] = record_table.to_epoch_minutes(
+                datetime.strptime(fields[all_data_file.i_date], '%Y-%m-%d %H:%M'))
+            record[all_data_file.i_voltage] = float(fields[all_data_file.i_voltage])
+            record[all_data_file.i_current] = float(fields[all_data_file.i_current])
+            record[all_data_file.i_power_factor] = float(fields[all_data_file.i_power_factor])
+            record[all_data_file.i_apparent_power] = float(fields[all_data_file.i_apparent_power])
+            record[all_data_file.i_effective_power] = float(fields[all_data_file.i_effective_power])
+            records.append(record)
+
+        return records
+
+
+def measure(name: str, rows: int, function, *args):
+    start = time.perf_counter()
+    records = function(*args)
+    elapsed = time.perf_counter() - start
+    print("{:<24}{:>10.3f} s{:>14,.0f} rows/s".format(name, elapsed, rows / elapsed))
+    return records
+
+
+parser = ArgumentParser(description='Benchmark reading of all-data.csv')
+parser.add_argument('rows', type=int, nargs='?', default=500000,
+                    help='number of rows (default %(default)s)')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as dir:
+        csv_path = os.path.join(dir, "all-data.csv")
+        columns_path = os.path.join(dir, "all-data.columns")
+        expected = write_csv(csv_path, args.rows)
+        columnar_file.write_table(columns_path, expected)
+
+        results = [
+            measure("csv, line by line", args.rows, read_csv_data_by_line, csv_path),
+            measure("csv, blocks", args.rows, report.read_csv_data, csv_path),
+            measure("columnar file", args.rows, columnar_file.read_table, columns_path),
+        ]
+        for records in results:
+            if records.columns != expected.columns:
+                raise Exception("Records read differ from records written")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Benchmark suite on a synthetic dump (see benchmarks.dump_generator): time,
+# records/sec and peak memory of the stages of el4000.py and report.py.
+#
+# Every stage runs twice: once timed, once with tracemalloc for the peak of
+# memory allocated by Python (which slows it down too much to be timed).
+#
+# Run from the repository root: python3 -m benchmarks.suite [options]
+
+from argparse import ArgumentParser
+from datetime import datetime
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import el4000
+from el4000 import ALL_DATA_RAW_FILENAME, ALL_DATA_CACHE_FILENAME
+import printers
+import report
+from benchmarks.dump_generator import LOAD_PATTERNS, generate_dump
+
+
+def measure(name: str, function, setup=None):
+    """
+    Runs function (after setup, if given) which returns the number of records
+    it processed, and prints its time, records/sec and peak memory.
+    """
+    if setup:
+        setup()
+    start = time.perf_counter()
+    records = function()
+    elapsed = time.perf_counter() - start
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("{:<32}{:>10,}{:>10.3f} s{:>14,.0f} rec/s{:>10.1f} MiB".format(
+        name, records, elapsed, records / elapsed, peak / (1 << 20)))
+
+
+def _bin_paths(dir: str):
+    """Info file and data files of a dump, in chronological order."""
+    bin_filenames = el4000.list_bin_files(dir)
+    return [os.path.join(dir, filename) for filename
+            in bin_filenames[:1] + list(reversed(bin_filenames[1:]))]
+
+
+def _remove_outputs(dir: str):
+    for filename in os.listdir(dir):
+        if not filename.lower().endswith(".bin"):
+            os.remove(os.path.join(dir, filename))
+
+
+def bench_process_file(dir: str) -> int:
+    printer = printers.MemoryPrinter()
+    dt = [datetime(1970, 1, 1)]
+    for path in _bin_paths(dir):
+        el4000.process_file(path, printer, dt, False)
+    return len(printer.data)
+
+
+def bench_run_dir_mode(dir: str, records: int) -> int:
+    el4000.run_dir_mode(dir, None)
+    return records
+
+
+def bench_calculate_sessions_data(all_data) -> int:
+    report.calculate_sessions_data(all_data)
+    return len(all_data)
+
+
+def bench_write_simple_stats_file(all_data, dir: str) -> int:
+    report.write_simple_stats_file(all_data, dir, mode='w')
+    return len(all_data)
+
+
+parser = ArgumentParser(description='Benchmark el4000.py and report.py on a synthetic dump')
+parser.add_argument('--days', type=float, default=365,
+                    help='time span of the dump in days (default %(default)s)')
+parser.add_argument('--load', choices=LOAD_PATTERNS, default='appliance',
+                    help="load pattern of the dump (default '%(default)s')")
+parser.add_argument('--gap-probability', type=float, default=0.1,
+                    help='probability of a gap at a header (default %(default)s)')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    # Only the results are printed, report.py logs at INFO level by default
+    logging.getLogger().setLevel(logging.ERROR)
+    with tempfile.TemporaryDirectory() as dir:
+        records = generate_dump(dir, datetime(2021, 1, 1), int(args.days * 1440),
+                                gap_probability=args.gap_probability, load=args.load)
+        print("Dump of {:,} records in {}".format(records, dir))
+        csv_path = os.path.join(dir, ALL_DATA_RAW_FILENAME)
+        cache_path = os.path.join(dir, ALL_DATA_CACHE_FILENAME)
+
+        measure("el4000.process_file", lambda: bench_process_file(dir))
+        measure("el4000.run_dir_mode", lambda: bench_run_dir_mode(dir, records),
+                setup=lambda: _remove_outputs(dir))
+
+        measure("report.read_data (columnar)",
+                lambda: len(report.read_data(csv_path, cache_path)))
+        measure("report.read_data (csv)", lambda: len(report.read_data(csv_path)))
+
+        all_data = report.read_data(csv_path, cache_path)
+        measure("report.calculate_sessions_data",
+                lambda: bench_calculate_sessions_data(all_data))
+        measure("report.write_simple_stats_file",
+                lambda: bench_write_simple_stats_file(all_data, dir))
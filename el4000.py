@@ -5,16 +5,38 @@
 # Copyright (C) 2014 Peter Wu <peter@lekensteyn.nl>
 
 import os, sys
-from argparse import ArgumentParser
+import bisect
+from argparse import ArgumentParser, ArgumentTypeError
+from collections import namedtuple
 import datetime
+import itertools
+import json
 import logging
+import mmap
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Any, Tuple
 
-from defs import info, data_hdr, data, setup, SETUP_MAGIC, STARTCODE
+from defs import info, data, data_hdr, setup, SETUP_MAGIC, STARTCODE
 import printers
+from pkg import all_data_file, columnar_file, data_decoder, file_index, manifest, \
+    profiler, read_ahead, record_table, run_merge, sqlite_store
 
 
 ALL_DATA_RAW_FILENAME = "all-data.csv"
+# Binary columnar copy of ALL_DATA_RAW_FILENAME, see pkg.columnar_file
+ALL_DATA_CACHE_FILENAME = "all-data.columns"
+# Optional SQLite copy of the data and info, see pkg.sqlite_store
+ALL_DATA_DATABASE_FILENAME = "all-data.sqlite"
+# Bin files processed in incremental dir mode, see pkg.manifest
+MANIFEST_FILENAME = "processed-files.json"
+# Outputs of fleet mode, in the root directory of the card dumps
+FLEET_OUTPUT_DIRNAME = "fleet"
+FLEET_SUMMARY_FILENAME = "fleet-summary.yml"
+# Output buffer for streaming records to ALL_DATA_RAW_FILENAME
+WRITE_BUFFER_SIZE = 1 << 20
 
 _logger = logging.getLogger(__name__)
 
@@ -76,73 +98,203 @@ def process_setup(filename, printer, setup_args):
         else:
             _logger.info('No changes, not writing file')
 
-def process_file(filename, printer, dt, data_only):
+def process_file(filename, printer, dt, data_only, use_mmap=False):
+    """Returns the number of records printed from a data file, 0 otherwise."""
     with open(filename, 'rb') as f:
         size = os.fstat(f.fileno()).st_size
         if size == info.size():
             # Info files
-            t = info.parse_from_file(f)
-            # Initialize time from info file
-            dt[0] = datetime.datetime(2000 + t.init_date_year,
-                    t.init_date_month, t.init_date_day,
-                    t.init_time_hour, t.init_time_minute)
-            if not data_only:
-                printer.print_info(t)
+            process_info(info.parse_from_file(f), printer, dt, data_only)
         else:
             # Data files.
-
-            # First, test whether this file is not a setup file
-            buf = f.read(len(SETUP_MAGIC))
-            if buf == SETUP_MAGIC:
-                _logger.warn('Setup file is ignored. Use --setup option instead')
-                return
-
-            eof = 4 * b'\xff'
-            while True:
-                if len(buf) < len(eof):
-                    buf += f.read(len(eof) - len(buf))
-                if not buf:
-                    break
-                elif buf == eof[0:len(buf)]:
-                    # End of file code (or short read at the end)
-                    #sys.stdout.flush()
-                    #_logger.info('EOF detected, skipping')
-                    #continue
-                    break
-
-                if buf[0:len(STARTCODE)] == STARTCODE:
-                    # Not data, but header before data
-                    buf += f.read(data_hdr.size() - len(buf))
-                    t = data_hdr.unpack(buf)
-                    # New time reference!
-                    dt[0] = datetime.datetime(2000 + t.record_year,
-                            t.record_month, t.record_day,
-                            t.record_hour, t.record_minute)
-                    printer.print_data_header(t)
-                else:
-                    buf += f.read(data.size() - len(buf))
-                    t = data.unpack(buf)
-                    # For time reference
-                    date_str = dt[0].strftime('%Y-%m-%d %H:%M')
-                    printer.print_data(t, date=date_str)
-                    # Assume that this is called for every minute
-                    dt[0] += datetime.timedelta(minutes=1)
-
-                # Clear buffer since it is processed
-                buf = b''
-
-def run_dir_mode(dir: str, printer):
-    _logger.info("Processing dir: %s", dir)
-
-    memory_printer = printers.MemoryPrinter()
-
+            chunks = decode_data_file(f, use_mmap)
+            if chunks is not None:
+                return process_chunks(chunks, printer, dt)
+    return 0
+
+def process_contents(buf, printer, dt, data_only):
+    """Like process_file, for the contents of a file which was read before."""
+    if len(buf) == info.size():
+        process_info(info.unpack(buf), printer, dt, data_only)
+        return 0
+    chunks = decode_data(buf)
+    if chunks is not None:
+        return process_chunks(chunks, printer, dt)
+    return 0
+
+def process_info(t, printer, dt, data_only):
+    # Initialize time from info file
+    dt[0] = datetime.datetime(2000 + t.init_date_year,
+            t.init_date_month, t.init_date_day,
+            t.init_time_hour, t.init_time_minute)
+    if not data_only:
+        printer.print_info(t)
+
+def decode_data_file(f, use_mmap=False):
+    """
+    Decodes an opened data file into a list of DataChunk. Returns None if the
+    file turns out to be a setup file.
+    """
+    size = os.fstat(f.fileno()).st_size
+    if use_mmap and size > 0:
+        # Decode in place from the page cache, without copying the file
+        # contents into Python objects first.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return decode_data(buf)
+    return decode_data(f.read())
+
+def decode_data(buf):
+    # First, test whether this file is not a setup file
+    if buf[0:len(SETUP_MAGIC)] == SETUP_MAGIC:
+        _logger.warn('Setup file is ignored. Use --setup option instead')
+        return None
+    return data_decoder.decode_data(buf)
+
+def process_chunks(chunks, printer, dt):
+    """Prints decoded chunks, returns the number of records."""
+    records = 0
+    for chunk in chunks:
+        if chunk.header:
+            t = chunk.header
+            # New time reference!
+            dt[0] = datetime.datetime(2000 + t.record_year,
+                    t.record_month, t.record_day,
+                    t.record_hour, t.record_minute)
+            printer.print_data_header(t)
+        printer.print_data_chunk(chunk, dt[0])
+        # Assume that every record covers one minute
+        dt[0] += datetime.timedelta(minutes=len(chunk.voltage))
+        records += len(chunk.voltage)
+    return records
+
+def parse_time(value):
+    """Parses a --from or --to argument into epoch minutes."""
+    for date_format in (record_table.DATE_FORMAT, '%Y-%m-%d'):
+        try:
+            return record_table.to_epoch_minutes(
+                datetime.datetime.strptime(value, date_format))
+        except ValueError:
+            pass
+    raise ArgumentTypeError(
+        "invalid date '{}', expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM'".format(value))
+
+def select_runs(filename, dt, time_range, index):
+    """
+    Finds the records of a data file within time_range (epoch minutes, end
+    excluded) using its entry in index, the file itself is not opened unless
+    the entry is outdated. dt is advanced to the end of the file like in
+    process_file.
+    Returns a list of (run, date of the run, first, stop) tuples, the records
+    first until stop of a run are within the range.
+    """
+    runs = index.get_runs(filename)
+    if runs is None:
+        _logger.warn('Setup file is ignored. Use --setup option instead')
+        return []
+    start, end = time_range
+    minutes = record_table.to_epoch_minutes(dt[0])
+    selected = []
+    for run in runs:
+        if run.date is not None:
+            # New time reference!
+            minutes = run.date
+        first = max(0, start - minutes)
+        stop = min(run.count, end - minutes)
+        if first < stop:
+            selected.append((run, minutes, first, stop))
+        # Assume that every record covers one minute
+        minutes += run.count
+    dt[0] = record_table.from_epoch_minutes(minutes)
+    return selected
+
+def process_runs(filename, printer, selected):
+    """Reads and prints only the records selected by select_runs."""
+    with open(filename, 'rb') as f:
+        for run, minutes, first, stop in selected:
+            header = None
+            if run.header_offset is not None:
+                f.seek(run.header_offset)
+                header = data_decoder.decode_header(f.read(data_hdr.size()), 0)
+                printer.print_data_header(header)
+            # The record of minute n after the header is at a fixed offset
+            f.seek(run.start + first * data.size())
+            buf = f.read((stop - first) * data.size())
+            chunk = data_decoder.DataChunk(header, *data_decoder.decode_records(buf))
+            printer.print_data_chunk(chunk,
+                                     record_table.from_epoch_minutes(minutes + first))
+
+def _decode_data_path(path, use_mmap):
+    """
+    Worker for parallel dir mode. Headers are returned as plain tuples since
+    the namedtuple types of Format cannot be pickled.
+    """
+    with profiler.stage("decode in worker " + os.path.basename(path)) as stage, \
+         open(path, 'rb') as f:
+        chunks = decode_data_file(f, use_mmap)
+        if chunks is not None:
+            stage.records = sum(len(chunk.voltage) for chunk in chunks)
+    if chunks is None:
+        return None
+    return [chunk._replace(header=tuple(chunk.header) if chunk.header else None)
+            for chunk in chunks]
+
+# A run of records located by file_index.scan_runs, dated from its header or
+# the records before it. headerless tells whether the date is inferred.
+DatedRun = namedtuple('DatedRun', 'path start date count headerless')
+
+def _read_dated_runs(dated_runs):
+    """
+    Decodes dated runs one by one, yields their records as (date, headerless,
+    voltage, current, power_factor).
+    """
+    for dated_run in dated_runs:
+        with open(dated_run.path, 'rb') as f:
+            f.seek(dated_run.start)
+            buf = f.read(dated_run.count * data.size())
+        voltage, current, power_factor = data_decoder.decode_records(buf)
+        yield from zip(range(dated_run.date, dated_run.date + dated_run.count),
+                       itertools.repeat(dated_run.headerless),
+                       voltage, current, power_factor)
+
+def _restore_headers(chunks):
+    if chunks is None:
+        return None
+    return [chunk._replace(header=data_hdr.factory._make(chunk.header)
+                           if chunk.header else None)
+            for chunk in chunks]
+
+def write_records(file, records):
+    for date, *fields in zip(*records.columns):
+        file.write(all_data_file.format_line(record_table.format_date(date), *fields))
+
+def _starts_with_header(path):
+    with open(path, 'rb') as f:
+        return f.read(len(STARTCODE)) == STARTCODE
+
+def _starts_with_records(path):
+    """Tells whether a file starts with records without a header before them."""
+    with open(path, 'rb') as f:
+        start = f.read(max(len(SETUP_MAGIC), len(data_decoder.EOF_CODE)))
+    return len(start) > 0 and not start.startswith(STARTCODE) and \
+        not start.startswith(SETUP_MAGIC) and not start.startswith(data_decoder.EOF_CODE)
+
+def _read_last_date(path):
+    """Returns the date of the last record in an all-data.csv file, or 0."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 4096))
+        last_line = f.read().decode().rstrip("\n").rsplit("\n", 1)[-1]
+    if last_line + "\n" == all_data_file.expected_header_line:
+        return 0
+    return record_table.parse_date(last_line.split(",")[all_data_file.i_date])
+
+def list_bin_files(dir: str):
+    """Returns the names of the bin files in dir, sorted by name."""
     filenames = [] # type: list[str]
     (_, _, filenames) = next(os.walk(dir), (None, None, []))
     if len(filenames) == 0:
         raise Exception("Directory '{}' is empty or invalid".format(dir))
 
-
-    last_datetime = [None]
     bin_filenames = []
     for filename in filenames:
         if filename.lower().endswith(".bin"):
@@ -151,61 +303,489 @@ def run_dir_mode(dir: str, printer):
             _logger.info("Skipping file: %s", filename)
 
     bin_filenames.sort()
+    return bin_filenames
+
+def run_dir_mode(dir: str, printer, use_mmap=False, jobs=1, stream=False,
+                 incremental=False, output_dir: str = None, database=False,
+                 read_ahead_depth=0, read_ahead_memory=read_ahead.DEFAULT_MEMORY_BUDGET,
+                 duplicates="first"):
+    """
+    Decodes the bin files of dir and writes the results to output_dir (dir by
+    default), also to a SQLite database if database is set. Returns the number
+    of records written.
+    Records which are out of order are merged, keeping one record of every
+    minute according to duplicates (see pkg.run_merge), except with stream.
+    With read_ahead_depth, up to that many data files (of up to read_ahead_memory
+    bytes in total) are read in the background while one is decoded.
+    """
+    _logger.info("Processing dir: %s", dir)
+    if output_dir is None:
+        output_dir = dir
+
+    last_datetime = [None]
+    with profiler.stage("list files") as stage:
+        bin_filenames = list_bin_files(dir)
+        stage.records = len(bin_filenames)
 
     # first file of files sorted asc by filename treated as HEX number, should be an info file
     # it should initialise last_datetime
     info_filename = bin_filenames[0]
     # apparently bin files, sorted asc are in reversed chrono order. We need to reverse the list
     # and the earliest data file has no header, so last_datetime needs to be initialised before, by reading info file
-    data_filenames = reversed(bin_filenames[1:])
-
-    def process_bin_file(filename):
+    data_filenames = list(reversed(bin_filenames[1:]))
+    # Whatever the order of the names, the earliest data file is the one which
+    # does not start with a header. Its first records are dated from the info
+    # file, not from the end of the file before it.
+    earliest_filename = next((filename for filename in data_filenames
+                              if _starts_with_records(os.path.join(dir, filename))), None)
+    if earliest_filename and any(
+            _starts_with_header(os.path.join(dir, filename))
+            for filename in data_filenames[:data_filenames.index(earliest_filename)]):
+        _logger.warning("Earliest data file %s is not the first one by name", earliest_filename)
+    info_datetime = [None]
+
+    def start_data_file(filename):
         _logger.info("Processing file: %s", filename)
-        abs_path = os.path.join(dir, filename)
-        process_file(abs_path, memory_printer, last_datetime, False)
-
-    process_bin_file(info_filename)
-    for filename in data_filenames:
-        process_bin_file(filename)
-    pass
-
-    def verify_sorted(entries):
-        last_datetime = "1970-01-01 00:00"
-        for entry in entries:
-            date = entry["date"]
-            if date <= last_datetime:
-                raise Exception("Entries are not sorted by date!")
-            last_datetime = date
+        if filename == earliest_filename:
+            last_datetime[0] = info_datetime[0]
+
+    def process_info_file(memory_printer):
+        _logger.info("Processing file: %s", info_filename)
+        with profiler.stage("decode " + info_filename):
+            process_file(os.path.join(dir, info_filename), memory_printer, last_datetime,
+                         False, use_mmap)
+
+    def date_runs(data_filenames):
+        """
+        Locates and dates the runs of records of data files, like
+        process_bin_files decodes them, but without decoding any record.
+        Returns a list of DatedRun of the runs with records.
+        """
+        minutes = record_table.to_epoch_minutes(last_datetime[0])
+        dated_runs = []
+        for filename in data_filenames:
+            path = os.path.join(dir, filename)
+            if filename == earliest_filename:
+                minutes = record_table.to_epoch_minutes(info_datetime[0])
+            runs = file_index.scan_runs(path)
+            if runs is None:
+                # Setup file
+                continue
+            for run in runs:
+                if run.date is not None:
+                    minutes = run.date
+                if run.count:
+                    dated_runs.append(DatedRun(path, run.start, minutes, run.count,
+                                               run.date is None))
+                minutes += run.count
+        return dated_runs
+
+    def merge_bin_files(memory_printer, runs):
+        """
+        Decodes ascending runs of dated runs while merging them by date, see
+        pkg.run_merge. Returns the number of records kept.
+        """
+        _logger.warning("Entries are not sorted by date, merging %d runs", len(runs))
+        records = 0
+        with profiler.stage("merge") as stage:
+            merged = run_merge.merge([_read_dated_runs(dated_runs) for dated_runs in runs],
+                                     duplicates)
+            for start, voltage, current, power_factor in run_merge.to_chunks(merged):
+                memory_printer.print_data_chunk(
+                    data_decoder.DataChunk(None, voltage, current, power_factor),
+                    record_table.from_epoch_minutes(start))
+                records += len(voltage)
+            stage.records = records
+        _logger.info("Entries were merged by date, %d records kept", records)
+        return records
+
+    def process_bin_files(memory_printer, data_filenames=data_filenames):
+        """Returns the number of records decoded."""
+        process_info_file(memory_printer)
+        records = 0
+        info_datetime[0] = last_datetime[0]
+        with profiler.stage("date runs") as stage:
+            dated_runs = date_runs(data_filenames)
+            stage.records = sum(dated_run.count for dated_run in dated_runs)
+            runs = run_merge.split_ascending(dated_runs)
+        if len(runs) > 1:
+            return merge_bin_files(memory_printer, runs)
+        if jobs > 1:
+            # Data files are decoded independently of each other in worker
+            # processes. Time references are only resolved afterwards, in
+            # chronological order: headerless chunks continue from the end of the
+            # previous chunk, or from the info file for the earliest data file.
+            data_paths = [os.path.join(dir, filename) for filename in data_filenames]
+            _logger.info("Decoding %d files using %d processes", len(data_paths), jobs)
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                decoded = pool.map(profiler.call_in_worker,
+                                   [profiler.is_enabled()] * len(data_paths),
+                                   [_decode_data_path] * len(data_paths), data_paths,
+                                   [use_mmap] * len(data_paths))
+                for filename, (chunks, worker_stages) in zip(data_filenames, decoded):
+                    profiler.add_worker_stages(worker_stages)
+                    start_data_file(filename)
+                    # Includes waiting for the worker which decodes the file
+                    with profiler.stage("decode " + filename) as stage:
+                        chunks = _restore_headers(chunks)
+                        if chunks is not None:
+                            stage.records = process_chunks(chunks, memory_printer,
+                                                           last_datetime)
+                            records += stage.records
+        elif read_ahead_depth > 0:
+            data_paths = [os.path.join(dir, filename) for filename in data_filenames]
+            for path, contents in read_ahead.read_ahead(data_paths, read_ahead_depth,
+                                                        read_ahead_memory):
+                filename = os.path.basename(path)
+                start_data_file(filename)
+                # Includes waiting for the file to be read
+                with profiler.stage("decode " + filename) as stage:
+                    stage.records = process_contents(contents, memory_printer,
+                                                     last_datetime, False)
+                    records += stage.records
+        else:
+            for filename in data_filenames:
+                start_data_file(filename)
+                with profiler.stage("decode " + filename) as stage:
+                    stage.records = process_file(os.path.join(dir, filename), memory_printer,
+                                                 last_datetime, False, use_mmap)
+                    records += stage.records
         _logger.info("Entries are correctly sorted by date")
+        return records
+
+    def write_info(memory_printer, mode='x'):
+        output_info_filepath = os.path.join(output_dir, "info.yml")
+        _logger.info("Writing info to: " + output_info_filepath)
+        with open(output_info_filepath, mode) as output_info_file:
+            for entry in memory_printer.info:
+                output_info_file.write("{}: {}\n".format(entry["key"], entry["val"]))
+        _logger.info("Info written successfully")
+
+    def write_database(memory_printer, records, replace_all):
+        unit_id = int(next(entry["val"] for entry in memory_printer.info
+                           if entry["key"] == "unit_id"))
+        _logger.info("Writing %d records of unit %d to: %s", len(records), unit_id,
+                     output_database_filepath)
+        with profiler.stage("write database") as stage:
+            stage.records = len(records)
+            sqlite_store.write_unit(output_database_filepath, unit_id, memory_printer.info,
+                                    records, replace_all)
+        _logger.info("Database written successfully")
+
+    output_data_raw_filepath = os.path.join(output_dir, ALL_DATA_RAW_FILENAME)
+
+    output_database_filepath = os.path.join(output_dir, ALL_DATA_DATABASE_FILENAME)
+
+    output_data_cache_filepath = os.path.join(output_dir, ALL_DATA_CACHE_FILENAME)
+
+    manifest_filepath = os.path.join(output_dir, MANIFEST_FILENAME)
+
+    if incremental:
+        with profiler.stage("hash files") as stage:
+            old_manifest = manifest.read_manifest(manifest_filepath)
+            new_manifest = {}
+            for filename in bin_filenames:
+                new_manifest[filename] = manifest.file_entry(os.path.join(dir, filename),
+                                                             old_manifest.get(filename))
+            stage.records = len(new_manifest)
+
+    if incremental and os.path.exists(output_data_raw_filepath):
+        changed = [i for i, filename in enumerate(data_filenames)
+                   if not manifest.is_unchanged(old_manifest.get(filename),
+                                                new_manifest[filename])]
+        if not changed and \
+                manifest.is_unchanged(old_manifest.get(info_filename),
+                                      new_manifest[info_filename]):
+            _logger.info("No new or changed files")
+            return 0
+
+        # A file without header continues from the end of the previous file,
+        # so that one has to be decoded as well.
+        first = changed[0] if changed else len(data_filenames)
+        while 0 < first < len(data_filenames) and \
+                not _starts_with_header(os.path.join(dir, data_filenames[first])):
+            first -= 1
+
+        memory_printer = printers.MemoryPrinter()
+        process_bin_files(memory_printer, data_filenames[first:])
+        write_info(memory_printer, 'w')
+
+        # Records up to the last one written before are already there
+        last_date = _read_last_date(output_data_raw_filepath)
+        records = memory_printer.data
+        new_records = records.slice(bisect.bisect_right(records.date, last_date),
+                                    len(records))
+        _logger.info("Skipping %d records which were written before",
+                     len(records) - len(new_records))
+
+        _logger.info("Appending %d records to: %s", len(new_records),
+                     output_data_raw_filepath)
+        with profiler.stage("write csv") as stage:
+            stage.records = len(new_records)
+            with open(output_data_raw_filepath, 'a') as output_data_raw_file:
+                write_records(output_data_raw_file, new_records)
+        if os.path.exists(output_data_cache_filepath):
+            with profiler.stage("write columnar") as stage:
+                stage.records = len(new_records)
+                with open(output_data_cache_filepath, 'ab') as output_data_cache_file:
+                    columnar_file.ColumnarWriter(output_data_cache_file,
+                                                 write_header=False).write(new_records)
+        _logger.info("Data written successfully")
+        if database:
+            if os.path.exists(output_database_filepath):
+                write_database(memory_printer, new_records, replace_all=False)
+            else:
+                _logger.warning("Database %s does not exist, run without --incremental "
+                                "to create it", output_database_filepath)
+
+        manifest.write_manifest(manifest_filepath, new_manifest)
+        return len(new_records)
+
+    if stream:
+        # Records are written out as soon as they are decoded and checked
+        _logger.info("Streaming data to: " + output_data_raw_filepath)
+        with open(output_data_raw_filepath, 'x',
+                  buffering=WRITE_BUFFER_SIZE) as output_data_raw_file, \
+             open(output_data_cache_filepath, 'xb',
+                  buffering=WRITE_BUFFER_SIZE) as output_data_cache_file:
+            try:
+                columnar_writer = columnar_file.ColumnarWriter(output_data_cache_file)
+                csv_printer = printers.AllDataCSVPrinter(output_data_raw_file,
+                                                         columnar_writer)
+                records = process_bin_files(csv_printer)
+                # The cache must not be older than the CSV file
+                output_data_raw_file.close()
+                columnar_writer.flush()
+            except Exception:
+                output_data_raw_file.close()
+                output_data_cache_file.close()
+                os.remove(output_data_raw_filepath)
+                os.remove(output_data_cache_filepath)
+                raise
+        _logger.info("Data written successfully")
+        write_info(csv_printer)
+        if incremental:
+            manifest.write_manifest(manifest_filepath, new_manifest)
+        return records
 
-    verify_sorted(memory_printer.data)
-
-    output_info_filepath = os.path.join(dir, "info.yml")
-    _logger.info("Writing info to: " + output_info_filepath)
-    with open(output_info_filepath, 'x') as output_info_file:
-        for entry in memory_printer.info:
-            output_info_file.write("{}: {}\n".format(entry["key"], entry["val"]))
-    _logger.info("Info written successfully")
+    memory_printer = printers.MemoryPrinter()
+    process_bin_files(memory_printer)
+    write_info(memory_printer)
 
-    output_data_raw_filepath = os.path.join(dir, ALL_DATA_RAW_FILENAME)
     _logger.info("Writing data to: " + output_data_raw_filepath)
-    with open(output_data_raw_filepath, 'x') as output_data_raw_file:
-        header = ",".join(["date", "voltage", "current", "power_factor", "apparent_power", "effective_power"])
-        output_data_raw_file.write(header + "\n")
-        for entry in memory_printer.data:
-            line = ",".join([
-                entry["date"], 
-                str(entry["voltage"]), 
-                str(entry["current"]), 
-                str(entry["power_factor"]), 
-                str(entry["apparent_power"]), 
-                str(entry["effective_power"])
-            ])
-            output_data_raw_file.write(line + "\n")
+    with profiler.stage("write csv") as stage:
+        stage.records = len(memory_printer.data)
+        with open(output_data_raw_filepath, 'x') as output_data_raw_file:
+            output_data_raw_file.write(all_data_file.expected_header_line)
+            write_records(output_data_raw_file, memory_printer.data)
     _logger.info("Data written successfully")
 
-
-
+    _logger.info("Writing columnar data to: " + output_data_cache_filepath)
+    with profiler.stage("write columnar") as stage:
+        stage.records = len(memory_printer.data)
+        columnar_file.write_table(output_data_cache_filepath, memory_printer.data)
+    _logger.info("Columnar data written successfully")
+
+    if database:
+        write_database(memory_printer, memory_printer.data, replace_all=True)
+
+    if incremental:
+        manifest.write_manifest(manifest_filepath, new_manifest)
+    return len(memory_printer.data)
+
+def read_unit_id(dir: str) -> int:
+    """Returns the unit_id of the info file in dir."""
+    info_path = os.path.join(dir, list_bin_files(dir)[0])
+    if os.path.getsize(info_path) != info.size():
+        raise Exception("No info file found in '{}'".format(dir))
+    with open(info_path, 'rb') as f:
+        return info.parse_from_file(f).unit_id
+
+def process_card(root: str, name: str, use_mmap=False, stream=False,
+                 incremental=False, database=False, read_ahead_depth=0,
+                 read_ahead_memory=read_ahead.DEFAULT_MEMORY_BUDGET,
+                 duplicates="first") -> dict:
+    """
+    Runs dir mode on card dump root/name, writing the results to
+    root/FLEET_OUTPUT_DIRNAME/unit-<unit_id>/name. Errors are not raised but
+    returned in the summary entry of the card.
+    """
+    start = time.perf_counter()
+    entry = {"name": name, "unit_id": None, "status": "ok", "records": 0, "error": None}
+    try:
+        dir = os.path.join(root, name)
+        entry["unit_id"] = read_unit_id(dir)
+        output_dir = os.path.join(root, FLEET_OUTPUT_DIRNAME,
+                                  "unit-{}".format(entry["unit_id"]), name)
+        os.makedirs(output_dir, exist_ok=True)
+        entry["records"] = run_dir_mode(dir, None, use_mmap, stream=stream,
+                                        incremental=incremental, output_dir=output_dir,
+                                        database=database,
+                                        read_ahead_depth=read_ahead_depth,
+                                        read_ahead_memory=read_ahead_memory,
+                                        duplicates=duplicates)
+    except Exception as e:
+        _logger.error("Processing of card '%s' failed: %s", name, e)
+        entry["status"] = "failed"
+        entry["error"] = "{}: {}".format(type(e).__name__, e)
+    entry["seconds"] = round(time.perf_counter() - start, 3)
+    return entry
+
+def run_fleet_mode(root: str, use_mmap=False, jobs=1, stream=False,
+                   incremental=False, database=False, read_ahead_depth=0,
+                   read_ahead_memory=read_ahead.DEFAULT_MEMORY_BUDGET,
+                   duplicates="first") -> int:
+    """
+    Processes every subdirectory of root as the card dump of one logger, up to
+    jobs of them at once, and writes a summary grouped by unit_id. A failing
+    card does not stop the others. Returns the number of failed cards.
+    """
+    names = sorted(name for name in os.listdir(root)
+                   if name != FLEET_OUTPUT_DIRNAME and
+                   os.path.isdir(os.path.join(root, name)))
+    if not names:
+        raise Exception("Directory '{}' has no card dumps".format(root))
+    _logger.info("Processing %d cards using %d processes", len(names), jobs)
+
+    entries = []
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(profiler.call_in_worker, profiler.is_enabled(),
+                                   process_card, root, name, use_mmap, stream,
+                                   incremental, database, read_ahead_depth,
+                                   read_ahead_memory, duplicates) for name in names]
+            for name, future in zip(names, futures):
+                try:
+                    entry, worker_stages = future.result()
+                    profiler.add_worker_stages(worker_stages, name + ": ")
+                    entries.append(entry)
+                except Exception as e:
+                    # The worker process itself died
+                    _logger.error("Processing of card '%s' failed: %s", name, e)
+                    entries.append({"name": name, "unit_id": None, "status": "failed",
+                                    "records": 0, "error": "{}: {}".format(
+                                        type(e).__name__, e), "seconds": None})
+    else:
+        for name in names:
+            entries.append(process_card(root, name, use_mmap, stream, incremental,
+                                        database, read_ahead_depth, read_ahead_memory,
+                                        duplicates))
+
+    write_fleet_summary(os.path.join(root, FLEET_SUMMARY_FILENAME), entries)
+    return sum(1 for entry in entries if entry["status"] != "ok")
+
+def write_fleet_summary(path: str, entries: "list[dict]"):
+    units = {}
+    for entry in entries:
+        units.setdefault(entry["unit_id"], []).append(entry)
+    with open(path, 'w') as file:
+        file.write("cards: {}\n".format(len(entries)))
+        file.write("failed: {}\n".format(
+            sum(1 for entry in entries if entry["status"] != "ok")))
+        file.write("records: {}\n".format(sum(entry["records"] for entry in entries)))
+        file.write("units:\n")
+        # Cards which failed before their unit_id was known come last
+        for unit_id in sorted(units, key=lambda unit_id: (unit_id is None, unit_id or 0)):
+            unit_entries = units[unit_id]
+            file.write("  - unit_id: {}\n".format(json.dumps(unit_id)))
+            file.write("    records: {}\n".format(
+                sum(entry["records"] for entry in unit_entries)))
+            file.write("    cards:\n")
+            for entry in unit_entries:
+                # JSON strings are valid YAML strings
+                file.write("      - name: {}\n".format(json.dumps(entry["name"])))
+                file.write("        status: {}\n".format(json.dumps(entry["status"])))
+                file.write("        records: {}\n".format(entry["records"]))
+                file.write("        seconds: {}\n".format(json.dumps(entry["seconds"])))
+                if entry["error"]:
+                    file.write("        error: {}\n".format(json.dumps(entry["error"])))
+    _logger.info("Fleet summary written to: %s", path)
+
+def _snapshot_bin_files(dir: str) -> dict:
+    """Returns the size and modification time of every bin file in dir."""
+    with os.scandir(dir) as entries:
+        return {entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+                for entry in entries
+                if entry.is_file() and entry.name.lower().endswith(".bin")}
+
+def run_watch_mode(dir: str, use_mmap=False, jobs=1, database=False,
+                   interval=10.0, settle=30.0, refresh_report=True, read_ahead_depth=0,
+                   read_ahead_memory=read_ahead.DEFAULT_MEMORY_BUDGET, duplicates="first"):
+    """
+    Watches dir for new or changed bin files and runs incremental dir mode (and
+    the incremental report, if refresh_report) on them, until interrupted.
+
+    dir is polled every interval seconds. Once its bin files stayed the same for
+    settle seconds (copying has finished), a run is requested from a worker
+    thread. At most one run waits while another one is going on: everything
+    that arrives in the meantime is picked up by that single run.
+    """
+    requests = queue.Queue(maxsize=1)
+    stopped = threading.Event()
+    # Set while the last run failed, it is retried at the next poll
+    failed = threading.Event()
+
+    def ingest():
+        records = run_dir_mode(dir, None, use_mmap, jobs, incremental=True,
+                               database=database, read_ahead_depth=read_ahead_depth,
+                               read_ahead_memory=read_ahead_memory, duplicates=duplicates)
+        _logger.info("Appended %d records", records)
+        # Also without new records, the report of an earlier run may have
+        # failed. It returns early when it is up to date.
+        if refresh_report:
+            # report.py imports this module, so it is imported only when needed
+            import report
+            database_path = os.path.join(dir, ALL_DATA_DATABASE_FILENAME)
+            if not database or not os.path.exists(database_path):
+                database_path = None
+            report.run_incremental_report(dir, os.path.join(dir, ALL_DATA_RAW_FILENAME),
+                                          os.path.join(dir, ALL_DATA_CACHE_FILENAME),
+                                          database_path=database_path)
+
+    def worker():
+        while not stopped.is_set():
+            try:
+                requests.get(timeout=interval)
+            except queue.Empty:
+                continue
+            try:
+                ingest()
+            except Exception as e:
+                # Keep watching, the files may be fixed or completed later
+                _logger.error("Processing of %s failed: %s", dir, e)
+                failed.set()
+
+    thread = threading.Thread(target=worker, name="el4000-watch")
+    thread.start()
+    _logger.info("Watching %s every %s seconds", dir, interval)
+
+    seen = None
+    requested = None
+    # Files which are there already are processed right away
+    changed_at = time.monotonic() - settle
+    try:
+        while True:
+            snapshot = _snapshot_bin_files(dir)
+            now = time.monotonic()
+            if seen is not None and snapshot != seen:
+                # Still changing, wait for it to settle
+                changed_at = now
+            seen = snapshot
+            if snapshot and (snapshot != requested or failed.is_set()) and \
+                    now - changed_at >= settle:
+                try:
+                    requests.put_nowait(snapshot)
+                    requested = snapshot
+                    failed.clear()
+                except queue.Full:
+                    # A run is waiting already, it will see these files too
+                    pass
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        _logger.info("Stopping, waiting for the current run to finish")
+    finally:
+        stopped.set()
+        thread.join()
 
 verbosities = [
     logging.CRITICAL,
@@ -239,11 +819,69 @@ parser.add_argument('-s', '--setup', metavar='key=value', nargs='*',
 parser.add_argument('-o', '--data-only', action='store_true',
                     help='Use info files only for updating the initial \
                     timestamp for data files, do not print their contents')
+parser.add_argument('--mmap', action='store_true',
+                    help='Memory-map data files and decode them in place \
+                    instead of reading them into memory')
+parser.add_argument('-j', '--jobs', type=int, default=1,
+                    help='Number of processes decoding data files in dir mode, \
+                    or processing cards in fleet mode (default %(default)s)')
+parser.add_argument('--read-ahead', type=int, default=0, metavar='N',
+                    help='Read up to N data files of dir mode in the background \
+                    while decoding, for slow media like SD cards. Not with \
+                    --mmap or --jobs (default %(default)s)')
+parser.add_argument('--read-ahead-memory', type=int,
+                    default=read_ahead.DEFAULT_MEMORY_BUDGET >> 20, metavar='MIB',
+                    help='Maximum size of the files read ahead in MiB \
+                    (default %(default)s)')
+parser.add_argument('--duplicates', choices=run_merge.DUPLICATE_POLICIES,
+                    default='first',
+                    help="Records of dir mode which are out of order are merged \
+                    by date. Of records of the same minute, keep the one decoded \
+                    first or last, or fail (default '%(default)s')")
+parser.add_argument('--stream', action='store_true',
+                    help='Write records of dir mode to the data file while \
+                    decoding, instead of collecting all of them in memory')
+parser.add_argument('--incremental', action='store_true',
+                    help='Only decode bin files of dir mode which are new or \
+                    changed since the last run and append their records')
+parser.add_argument('--from', dest='start', type=parse_time, metavar='DATE',
+                    help="Only print records from DATE ('YYYY-MM-DD' or \
+                    'YYYY-MM-DD HH:MM'). Data files are looked up in an index \
+                    (bin-index.json next to them) and only the records in \
+                    range are read. With --dir, the records of the directory \
+                    are printed instead of written to files")
+parser.add_argument('--to', dest='end', type=parse_time, metavar='DATE',
+                    help='Only print records before DATE, see --from')
+parser.add_argument('--profile', action='store_true',
+                    help='Print wall time, CPU time, records and peak memory growth \
+                    of every stage to stderr when done')
+parser.add_argument('--profile-json', metavar='FILE',
+                    help='Also write the --profile results to FILE as JSON \
+                    (implies --profile)')
 parser.add_argument('files', metavar='binfile', nargs='+',
                     help='info or data files (.bin) from SD card. If --setup \
                     is given, then this is the output file (and input for \
                     defaults). The order of files are significant when a \
                     timestamp is involved')
+parser.add_argument('--sqlite', action='store_true',
+                    help='Also write records and info of dir mode to a SQLite \
+                    database ({}), not with --stream'.format(ALL_DATA_DATABASE_FILENAME))
+parser.add_argument('--fleet', action='store_true',
+                    help='enable fleet mode. Pass one directory with one card \
+                    dump per subdirectory. Every card is processed like in dir \
+                    mode (up to --jobs at once), results are written to \
+                    fleet/unit-<unit_id>/<card> and summarized in \
+                    fleet-summary.yml')
+parser.add_argument('--watch', action='store_true',
+                    help='enable watch mode. Pass one directory, it is polled \
+                    for new or changed bin files, which are processed like in \
+                    dir mode with --incremental, followed by an incremental \
+                    report. Runs until interrupted')
+parser.add_argument('--watch-interval', type=float, default=10.0, metavar='SECONDS',
+                    help='polling interval of watch mode (default %(default)s)')
+parser.add_argument('--watch-settle', type=float, default=30.0, metavar='SECONDS',
+                    help='time without changes to the bin files before watch mode \
+                    processes them (default %(default)s)')
 parser.add_argument('--dir', action='store_true', 
                     help="enable dir mode. Pass one directory - all data will \
                     be saved automatically in chronological order in given directory: data.csv and info")
@@ -255,6 +893,9 @@ if __name__ == '__main__':
     args.verbose = min(args.verbose, len(verbosities) - 1)
     logging.basicConfig(level=verbosities[args.verbose])
 
+    if args.profile or args.profile_json:
+        profiler.enable()
+
     myprinter = available_printers[args.printer]
     files_count = len(args.files)
     if args.setup is not None:
@@ -265,14 +906,62 @@ if __name__ == '__main__':
     # Unknown date and time, initialize with something low.
     dt = [datetime.datetime(1970, 1, 1)]
 
-    if args.dir:
+    time_range = None
+    if args.start is not None or args.end is not None:
+        time_range = (args.start if args.start is not None else float('-inf'),
+                      args.end if args.end is not None else float('inf'))
+
+    if args.sqlite and args.stream:
+        parser.error('--sqlite cannot be used with --stream')
+    if args.read_ahead < 0:
+        parser.error('--read-ahead must not be negative')
+    if args.read_ahead and (args.mmap or (args.jobs > 1 and not args.fleet)):
+        parser.error('--read-ahead cannot be used with --mmap or --jobs')
+    read_ahead_memory = args.read_ahead_memory << 20
+
+    files = args.files
+    if args.watch:
         if files_count != 1:
-            _logger.error('Only one file (directory) can be specified for dir mode')
+            _logger.error('Only one file (directory) can be specified for watch mode')
             sys.exit(1)
-        run_dir_mode(args.files[0], myprinter)
+        run_watch_mode(args.files[0], args.mmap, args.jobs, args.sqlite,
+                       args.watch_interval, args.watch_settle,
+                       read_ahead_depth=args.read_ahead,
+                       read_ahead_memory=read_ahead_memory,
+                       duplicates=args.duplicates)
         sys.exit(0)
 
-    for filename in args.files:
+    if args.fleet:
+        if files_count != 1:
+            _logger.error('Only one file (directory) can be specified for fleet mode')
+            sys.exit(1)
+        failed = run_fleet_mode(args.files[0], args.mmap, args.jobs, args.stream,
+                                args.incremental, args.sqlite, args.read_ahead,
+                                read_ahead_memory, args.duplicates)
+        profiler.finish(args.profile_json)
+        sys.exit(1 if failed else 0)
+
+    if args.dir:
+        if files_count != 1:
+            _logger.error('Only one file (directory) can be specified for dir mode')
+            sys.exit(1)
+        if time_range is None:
+            run_dir_mode(args.files[0], myprinter, args.mmap, args.jobs,
+                         args.stream, args.incremental, database=args.sqlite,
+                         read_ahead_depth=args.read_ahead,
+                         read_ahead_memory=read_ahead_memory,
+                         duplicates=args.duplicates)
+            profiler.finish(args.profile_json)
+            sys.exit(0)
+        # Info file first, then data files in chronological order
+        bin_filenames = list_bin_files(args.files[0])
+        files = [os.path.join(args.files[0], filename) for filename
+                 in bin_filenames[:1] + list(reversed(bin_filenames[1:]))]
+
+    # Indexes of data files by directory, for time_range
+    indexes = {}
+
+    for filename in files:
         try:
             printer = myprinter(filename, separator=args.delimiter)
         except TypeError:
@@ -280,9 +969,30 @@ if __name__ == '__main__':
         # Treat setup specially, it acts as input and output file
         if args.setup is not None:
             process_setup(args.files[0], myprinter, args.setup)
+        elif time_range is not None and os.path.getsize(filename) != info.size():
+            dir = os.path.dirname(filename)
+            if dir not in indexes:
+                indexes[dir] = file_index.FileIndex(dir)
+            selected = select_runs(filename, dt, time_range, indexes[dir])
+            if selected:
+                if len(files) > 1 and not args.data_only:
+                    print('# ' + filename)
+                with profiler.stage("decode " + os.path.basename(filename)) as stage:
+                    process_runs(filename, printer, selected)
+                    stage.records = sum(stop - first for _, _, first, stop in selected)
         else:
             # Display current filename for multiple files
-            if files_count > 1 and not args.data_only:
+            if len(files) > 1 and not args.data_only:
                 print('# ' + filename)
 
-            process_file(filename, printer, dt, args.data_only)
+            with profiler.stage("decode " + os.path.basename(filename)) as stage:
+                stage.records = process_file(filename, printer, dt, args.data_only,
+                                             args.mmap)
+
+    for index in indexes.values():
+        try:
+            index.save()
+        except OSError as e:
+            _logger.warn('Unable to save index %s: %s', index.path, e)
+
+    profiler.finish(args.profile_json)
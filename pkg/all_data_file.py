@@ -6,4 +6,14 @@ i_voltage = EXPECTED_DATA_FIELDS.index("voltage")
 i_current = EXPECTED_DATA_FIELDS.index("current")
 i_power_factor = EXPECTED_DATA_FIELDS.index("power_factor")
 i_apparent_power = EXPECTED_DATA_FIELDS.index("apparent_power")
-i_effective_power = EXPECTED_DATA_FIELDS.index("effective_power")
\ No newline at end of file
+i_effective_power = EXPECTED_DATA_FIELDS.index("effective_power")
+
+def format_line(date, voltage, current, power_factor, apparent_power, effective_power) -> str:
+    return ",".join([
+        date,
+        str(voltage),
+        str(current),
+        str(power_factor),
+        str(apparent_power),
+        str(effective_power)
+    ]) + "\n"
@@ -0,0 +1,151 @@
+import bisect
+import os
+import struct
+import sys
+
+from pkg import all_data_file
+from pkg.record_table import RecordTable
+
+# Binary columnar copy of all-data.csv. Layout (all numbers little endian):
+#
+#   MAGIC
+#   length of the field line (uint64), field line (all_data_file.expected_header_line)
+#   blocks, each of them:
+#     number of records n (uint64)
+#     one column after another, every column n * 8 bytes (int64 for dates,
+#     float64 for the other fields), in the order of EXPECTED_DATA_FIELDS
+#
+# Every column of a block has a fixed width, so a block can be memory-mapped
+# or read straight into an array. Splitting the columns in blocks allows the
+# file to be written (or appended to) without having all records in memory.
+
+MAGIC = b'EL4KCOL\x01'
+BLOCK_RECORDS = 1 << 16
+
+_count = struct.Struct('<Q')
+_date = struct.Struct('<q')
+_swap = sys.byteorder != 'little'
+
+
+class ColumnarWriter:
+    """Writes a RecordTable in blocks of at most BLOCK_RECORDS records."""
+
+    def __init__(self, file, write_header: bool = True) -> None:
+        self.file = file
+        self.pending = RecordTable()
+        if write_header:
+            field_line = all_data_file.expected_header_line.encode()
+            file.write(MAGIC)
+            file.write(_count.pack(len(field_line)))
+            file.write(field_line)
+
+    def write(self, records: RecordTable) -> None:
+        for start in range(0, len(records), BLOCK_RECORDS):
+            self._write_block(records.slice(start, start + BLOCK_RECORDS))
+
+    def buffer(self) -> RecordTable:
+        """
+        Returns a table to which records can be appended. They are written in
+        blocks as soon as enough of them are collected, see flush.
+        """
+        if len(self.pending) >= BLOCK_RECORDS:
+            self.flush()
+        return self.pending
+
+    def flush(self) -> None:
+        if len(self.pending):
+            self.write(self.pending)
+            self.pending = RecordTable()
+
+    def _write_block(self, block: RecordTable) -> None:
+        self.file.write(_count.pack(len(block)))
+        for column in block.columns:
+            if _swap:
+                column = column[:]
+                column.byteswap()
+            column.tofile(self.file)
+
+
+def write_table(path: str, records: RecordTable) -> None:
+    with open(path, 'xb') as file:
+        ColumnarWriter(file).write(records)
+
+
+def _read_header(file, path: str) -> None:
+    if file.read(len(MAGIC)) != MAGIC:
+        raise Exception("Invalid columnar data file: " + path)
+    field_line_length, = _count.unpack(file.read(_count.size))
+    field_line = file.read(field_line_length).decode()
+    if field_line != all_data_file.expected_header_line:
+        raise Exception("Invalid fields in columnar data file: " + field_line)
+
+
+def read_table(path: str) -> RecordTable:
+    records = RecordTable()
+    with open(path, 'rb') as file:
+        _read_header(file, path)
+
+        while True:
+            count = file.read(_count.size)
+            if not count:
+                break
+            count, = _count.unpack(count)
+            for column in records.columns:
+                column.fromfile(file, count)
+
+    if _swap:
+        for column in records.columns:
+            column.byteswap()
+    return records
+
+
+def read_range(path: str, start_date: int = None, end_date: int = None) -> RecordTable:
+    """
+    Reads the records from epoch minute start_date and before end_date. Only
+    the first and last date of every block are read to find the blocks which
+    overlap the range, the other blocks are skipped.
+    """
+    records = RecordTable()
+    column_count = len(records.columns)
+    with open(path, 'rb') as file:
+        _read_header(file, path)
+
+        while True:
+            count = file.read(_count.size)
+            if not count:
+                break
+            count, = _count.unpack(count)
+            block_start = file.tell()
+            block_end = block_start + column_count * count * 8
+            if count == 0:
+                continue
+            dates_start = block_start + all_data_file.i_date * count * 8
+            file.seek(dates_start)
+            first, = _date.unpack(file.read(_date.size))
+            if end_date is not None and first >= end_date:
+                # Records are sorted, later blocks are out of range too
+                break
+            file.seek(dates_start + (count - 1) * 8)
+            last, = _date.unpack(file.read(_date.size))
+            if start_date is None or last >= start_date:
+                file.seek(block_start)
+                block = RecordTable()
+                for column in block.columns:
+                    column.fromfile(file, count)
+                    if _swap:
+                        column.byteswap()
+                start = 0 if start_date is None else bisect.bisect_left(block.date, start_date)
+                stop = count if end_date is None else \
+                    bisect.bisect_left(block.date, end_date, start)
+                for column, block_column in zip(records.columns, block.columns):
+                    column.extend(block_column[start:stop])
+            file.seek(block_end)
+    return records
+
+
+def is_up_to_date(path: str, source_path: str) -> bool:
+    """Tells whether file path exists and is not older than source_path."""
+    try:
+        return os.path.getmtime(path) >= os.path.getmtime(source_path)
+    except OSError:
+        return False
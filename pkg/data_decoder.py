@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# Bulk decoder for data files of the Energy Logger 4000
+#
+# A data file is a sequence of 5-byte data records, interrupted by 8-byte
+# headers (starting with STARTCODE) and terminated by an end of file code.
+# Instead of reading and unpacking the records one by one, the boundaries of
+# every contiguous run of records are located first, then each run is decoded
+# in one go into columns.
+
+from collections import namedtuple
+
+from defs import data_hdr, data, STARTCODE
+
+EOF_CODE = 4 * b'\xff'
+
+# header is a data_hdr tuple or None for records at the start of a file which
+# are not preceded by a header. The other fields are arrays of floats.
+DataChunk = namedtuple('DataChunk', 'header voltage current power_factor')
+
+
+def _find_aligned(buf, needle, start, end):
+    """
+    Returns the first offset of needle in buf[start:end] which is at a record
+    boundary (relative to start), or -1 if there is none.
+    """
+    pos = buf.find(needle, start, end)
+    while pos != -1 and (pos - start) % data.size() != 0:
+        pos = buf.find(needle, pos + 1, end)
+    return pos
+
+
+def decode_records(buf, start=0, end=None):
+    """
+    Decodes a contiguous run of data records from buf[start:end] into a tuple
+    of columns (voltage, current, power_factor).
+    """
+    if end is None:
+        end = len(buf)
+    view = memoryview(buf)[start:end]
+    columns = data.unpack_columns(view)
+    view.release()
+    return columns
+
+
+def find_runs(buf):
+    """
+    Locates the runs of records in the contents of a data file, without
+    decoding them. buf must support len() and find() (bytes or mmap for
+    example). Returns a list of (header, start, end) tuples, where header is a
+    data_hdr tuple or None and buf[start:end] holds the records of the run.
+    """
+    runs = []
+    header = None
+    pos = 0
+    size = len(buf)
+    while True:
+        # Records are followed by either a new header, an end of file code or
+        # the end of the buffer, whichever comes first.
+        full_end = pos + (size - pos) // data.size() * data.size()
+        run_end = full_end
+        for marker in (STARTCODE, EOF_CODE):
+            found = _find_aligned(buf, marker, pos, run_end + len(marker))
+            if found != -1 and found < run_end:
+                run_end = found
+
+        runs.append((header, pos, run_end))
+
+        tail = buf[run_end:run_end + len(EOF_CODE)]
+        if tail == EOF_CODE[0:len(tail)]:
+            # End of file code (or short read at the end)
+            break
+        if tail[0:len(STARTCODE)] != STARTCODE or \
+                run_end + data_hdr.size() > size:
+            raise RuntimeError('Truncated record at offset {0}'.format(run_end))
+
+        # Not data, but header before data
+        header = decode_header(buf, run_end)
+        pos = run_end + data_hdr.size()
+
+    # Skip the leading run if the file starts with a header
+    if not runs[0][0] and runs[0][1] == runs[0][2] and len(runs) > 1:
+        del runs[0]
+    return runs
+
+
+def decode_header(buf, offset):
+    view = memoryview(buf)[offset:offset + data_hdr.size()]
+    header = data_hdr.unpack(view)
+    view.release()
+    return header
+
+
+def decode_data(buf):
+    """
+    Splits the contents of a data file into chunks of records and decodes them.
+    buf must support len() and find() (bytes or mmap for example). Records are
+    decoded through memoryview slices, so buf is never copied.
+    Returns a list of DataChunk.
+    """
+    return [DataChunk(header, *decode_records(buf, start, end))
+            for header, start, end in find_runs(buf)]
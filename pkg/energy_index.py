@@ -0,0 +1,174 @@
+from array import array
+import bisect
+from contextlib import contextmanager
+from itertools import accumulate, islice
+import os
+import struct
+
+from pkg import record_table
+from pkg.record_table import RecordTable
+
+# Prefix sums of the energy of the minute records. Entry i of cumulative_wh is
+# the energy [Wh] of all records before index i (every record stands for one
+# minute), so the energy of any time range is the difference of two entries,
+# found by binary search in the dates. The file holds one entry per record, so
+# new records are appended in place. Layout of the file (little endian):
+#
+#   MAGIC
+#   per record: date (int64, epoch minutes), energy [Wh] up to and including
+#   the record (float64)
+
+MAGIC = b'EL4KNRG\x02'
+
+_entry = struct.Struct('<qd')
+
+
+class EnergyIndex:
+    """Dates of the records and the energy before each of them, see above."""
+
+    def __init__(self, date: array = None, cumulative_wh: array = None) -> None:
+        self.date = array('q') if date is None else date
+        self.cumulative_wh = array('d', [0.0]) if cumulative_wh is None else cumulative_wh
+
+    def __len__(self) -> int:
+        return len(self.date)
+
+    def extend(self, records: RecordTable) -> None:
+        """
+        Adds sorted records. Those already in the index from the first date of
+        records on are replaced.
+        """
+        if len(records) == 0:
+            return
+        keep = bisect.bisect_left(self.date, records.date[0])
+        del self.date[keep:]
+        del self.cumulative_wh[keep + 1:]
+        self.date.extend(records.date)
+        energy = accumulate((power / 60 for power in records.effective_power),
+                            initial=self.cumulative_wh[-1])
+        next(energy)
+        self.cumulative_wh.extend(energy)
+
+    def energy_wh(self, start_date: int = None, end_date: int = None) -> float:
+        """Returns the energy [Wh] from epoch minute start_date until before end_date."""
+        first = 0 if start_date is None else bisect.bisect_left(self.date, start_date)
+        stop = len(self.date) if end_date is None else \
+            bisect.bisect_left(self.date, end_date, first)
+        return self.cumulative_wh[stop] - self.cumulative_wh[first]
+
+    def periods(self, period_start, period_end, start_date: int = None) -> "list[tuple]":
+        """
+        Returns (start, energy [Wh]) of every period with records, from the
+        period of epoch minute start_date on if given.
+        """
+        periods = []
+        first = 0 if start_date is None else \
+            bisect.bisect_left(self.date, period_start(start_date))
+        while first < len(self.date):
+            begin = period_start(self.date[first])
+            stop = bisect.bisect_left(self.date, period_end(begin), first)
+            periods.append((begin, self.cumulative_wh[stop] - self.cumulative_wh[first]))
+            first = stop
+        return periods
+
+    def daily(self, start_date: int = None) -> "list[tuple]":
+        return self.periods(record_table.day_start, lambda start: start + 1440, start_date)
+
+    def monthly(self, start_date: int = None) -> "list[tuple]":
+        return self.periods(record_table.month_start, record_table.next_month_start,
+                            start_date)
+
+
+class _FileEntries:
+    """The entries of an opened index file, read one by one when needed."""
+
+    def __init__(self, file) -> None:
+        self.file = file
+        self.count = (file.seek(0, os.SEEK_END) - len(MAGIC)) // _entry.size
+
+    def __getitem__(self, i: int) -> tuple:
+        self.file.seek(len(MAGIC) + i * _entry.size)
+        return _entry.unpack(self.file.read(_entry.size))
+
+
+class _FileDates:
+    """The date column of an index file, as a sequence for bisect."""
+
+    def __init__(self, entries: _FileEntries) -> None:
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return self.entries.count
+
+    def __getitem__(self, i: int) -> int:
+        return self.entries[i][0]
+
+
+class _FileCumulative:
+    """The cumulative_wh column of an index file, see EnergyIndex."""
+
+    def __init__(self, entries: _FileEntries) -> None:
+        self.entries = entries
+
+    def __len__(self) -> int:
+        return self.entries.count + 1
+
+    def __getitem__(self, i: int) -> float:
+        return 0.0 if i == 0 else self.entries[i - 1][1]
+
+
+def _check_magic(file, path: str) -> None:
+    if file.read(len(MAGIC)) != MAGIC:
+        raise Exception("Invalid energy index file: " + path)
+
+
+def _write_entries(file, index: EnergyIndex) -> None:
+    file.write(b''.join(map(_entry.pack, index.date, islice(index.cumulative_wh, 1, None))))
+
+
+def has_expected_magic(path: str) -> bool:
+    """Tells whether an index file exists and has the layout of this version."""
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def write_index(path: str, index: EnergyIndex) -> None:
+    with open(path + ".tmp", 'wb') as file:
+        file.write(MAGIC)
+        _write_entries(file, index)
+    os.replace(path + ".tmp", path)
+
+
+def append_index(path: str, records: RecordTable) -> None:
+    """
+    Adds sorted records to an index file. Entries from the first date of
+    records on are replaced, the ones before are neither read nor written.
+    """
+    if len(records) == 0:
+        return
+    with open(path, 'r+b') as file:
+        _check_magic(file, path)
+        entries = _FileEntries(file)
+        keep = bisect.bisect_left(_FileDates(entries), records.date[0])
+        index = EnergyIndex()
+        index.cumulative_wh[0] = _FileCumulative(entries)[keep]
+        index.extend(records)
+        file.seek(len(MAGIC) + keep * _entry.size)
+        file.truncate()
+        _write_entries(file, index)
+
+
+@contextmanager
+def open_index(path: str):
+    """
+    Opens an index file as an EnergyIndex whose entries are read from the file
+    only when needed: energy_wh reads just the entries of its binary searches,
+    whatever the size of the file. It cannot be extended.
+    """
+    with open(path, 'rb') as file:
+        _check_magic(file, path)
+        entries = _FileEntries(file)
+        yield EnergyIndex(_FileDates(entries), _FileCumulative(entries))
@@ -0,0 +1,87 @@
+from collections import namedtuple
+from datetime import datetime
+import json
+import mmap
+import os
+
+from defs import SETUP_MAGIC
+from pkg import data_decoder, record_table
+
+# Sparse index of data files: the runs of records in each file, with their byte
+# ranges and the date of their header. With it, the data files which hold
+# records of a time range can be found without opening any of them, and the
+# records of a run can be located from the minutes elapsed since its header.
+#
+# The index of the files in a directory is saved in INDEX_FILENAME there. An
+# entry is used as long as the size and modification time of its file match.
+
+INDEX_FILENAME = "bin-index.json"
+
+# header_offset and date are None for a run which is not preceded by a header,
+# it continues from the end of the previous run (or file). The records of the
+# run are count records of data.size() bytes from offset start.
+Run = namedtuple('Run', 'header_offset start count date')
+
+
+def header_date(t) -> int:
+    """Returns the date of a data_hdr tuple as epoch minutes."""
+    return record_table.to_epoch_minutes(datetime(2000 + t.record_year,
+        t.record_month, t.record_day, t.record_hour, t.record_minute))
+
+
+def scan_runs(path: str) -> "list[Run]":
+    """Returns the runs of a data file, or None for a setup file."""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if buf[0:len(SETUP_MAGIC)] == SETUP_MAGIC:
+                return None
+            runs = []
+            for header, start, end in data_decoder.find_runs(buf):
+                count = (end - start) // data_decoder.data.size()
+                if header:
+                    runs.append(Run(start - data_decoder.data_hdr.size(), start,
+                                    count, header_date(header)))
+                else:
+                    runs.append(Run(None, start, count, None))
+            return runs
+
+
+class FileIndex:
+    """Index of the data files in one directory."""
+
+    def __init__(self, dir: str) -> None:
+        self.path = os.path.join(dir, INDEX_FILENAME)
+        self.entries = {}
+        self.changed = False
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                self.entries = json.load(file)
+
+    def get_runs(self, path: str) -> "list[Run]":
+        """Returns the runs of a data file, or None for a setup file."""
+        stat = os.stat(path)
+        name = os.path.basename(path)
+        entry = self.entries.get(name)
+        if not entry or entry["size"] != stat.st_size or \
+                entry["mtime_ns"] != stat.st_mtime_ns:
+            runs = scan_runs(path)
+            entry = self.entries[name] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "runs": None if runs is None else [list(run) for run in runs]
+            }
+            self.changed = True
+        if entry["runs"] is None:
+            return None
+        return [Run(*run) for run in entry["runs"]]
+
+    def save(self) -> None:
+        if not self.changed:
+            return
+        with open(self.path + ".tmp", 'w') as file:
+            json.dump(self.entries, file, indent=2, sort_keys=True)
+            file.write("\n")
+        os.replace(self.path + ".tmp", self.path)
+        self.changed = False
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+
+# Keeps track of the bin files which were already processed in dir mode. Each
+# file name maps to its size, modification time and the SHA-256 of its
+# contents. Files are only hashed again when their size or modification time
+# changed.
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_entry(path: str, old_entry: dict = None) -> dict:
+    """
+    Returns the entry of a file. The hash of old_entry is reused if size and
+    modification time of the file did not change since.
+    """
+    stat = os.stat(path)
+    if old_entry and old_entry["size"] == stat.st_size and \
+            old_entry.get("mtime_ns") == stat.st_mtime_ns:
+        return old_entry
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": digest.hexdigest()
+    }
+
+
+def is_unchanged(old_entry: dict, new_entry: dict) -> bool:
+    """Tells whether a file has the same contents as when old_entry was taken."""
+    return old_entry is not None and old_entry["size"] == new_entry["size"] and \
+        old_entry["sha256"] == new_entry["sha256"]
+
+
+def read_manifest(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(path: str, entries: dict) -> None:
+    # Replace the old manifest only once the new one is complete
+    with open(path + ".tmp", 'w') as file:
+        json.dump(entries, file, indent=2, sort_keys=True)
+        file.write("\n")
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,156 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, memory is not reported there
+    resource = None
+
+# Per-stage profiling of el4000.py and report.py (--profile). Stages are timed
+# with `with profiler.stage(name) as stage:`, which does nothing unless
+# profiling was enabled. Code inside a stage may set stage.records to the
+# number of records it processed.
+#
+# The memory of a stage is how much it raised the peak resident set size of
+# its process: a stage which needs less memory than an earlier one shows 0.
+# Tracing every allocation instead (like benchmarks.suite does) would slow
+# the stages down too much to be timed. Stages run in worker processes are
+# profiled there and added to the stages of the main process, see
+# call_in_worker.
+
+_stages = None
+_started = None
+
+
+class Stage:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.records = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory_growth = None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "wall_time_s": self.wall_time,
+            "cpu_time_s": self.cpu_time,
+            "records": self.records,
+            "peak_memory_growth_bytes": self.peak_memory_growth
+        }
+
+    @classmethod
+    def from_dict(cls, entry: dict) -> "Stage":
+        current = cls(entry["name"])
+        current.wall_time = entry["wall_time_s"]
+        current.cpu_time = entry["cpu_time_s"]
+        current.records = entry["records"]
+        current.peak_memory_growth = entry["peak_memory_growth_bytes"]
+        return current
+
+
+def enable() -> None:
+    global _stages, _started
+    _stages = []
+    _started = datetime.now()
+
+
+def is_enabled() -> bool:
+    return _stages is not None
+
+
+def get_stages() -> "list[Stage]":
+    return _stages or []
+
+
+def _peak_memory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KiB on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def stage(name: str):
+    current = Stage(name)
+    if _stages is None:
+        yield current
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    peak_start = _peak_memory()
+    try:
+        yield current
+    finally:
+        current.wall_time = time.perf_counter() - wall_start
+        current.cpu_time = time.process_time() - cpu_start
+        if peak_start is not None:
+            current.peak_memory_growth = _peak_memory() - peak_start
+        _stages.append(current)
+
+
+def call_in_worker(profile: bool, function, *args):
+    """
+    Calls function(*args) in a worker process, with profiling enabled if
+    profile is set. Returns the result and the stages of the call (as dicts),
+    to be passed to add_worker_stages in the main process.
+    """
+    global _stages
+    _stages = [] if profile else None
+    try:
+        result = function(*args)
+        return result, [current.to_dict() for current in get_stages()]
+    finally:
+        # Worker processes are reused for other calls
+        _stages = None
+
+
+def add_worker_stages(stages: "list[dict]", prefix: str = "") -> None:
+    """Adds the stages returned by call_in_worker, with prefix before their names."""
+    if _stages is None:
+        return
+    for entry in stages:
+        current = Stage.from_dict(entry)
+        current.name = prefix + current.name
+        _stages.append(current)
+
+
+def print_summary(file=sys.stderr) -> None:
+    """Prints a table of all stages, in the order they ended."""
+    file.write("{:<40}{:>10}{:>10}{:>12}{:>14}{:>12}\n".format(
+        "stage", "wall [s]", "cpu [s]", "records", "records/s", "+peak [MiB]"))
+    for current in get_stages():
+        records = rate = peak = ""
+        if current.records is not None:
+            records = "{:,}".format(current.records)
+            if current.wall_time > 0:
+                rate = "{:,.0f}".format(current.records / current.wall_time)
+        if current.peak_memory_growth is not None:
+            peak = "{:.1f}".format(current.peak_memory_growth / (1 << 20))
+        file.write("{:<40}{:>10.3f}{:>10.3f}{:>12}{:>14}{:>12}\n".format(
+            current.name, current.wall_time, current.cpu_time, records, rate, peak))
+
+
+def write_json(path: str) -> None:
+    with open(path, 'w') as file:
+        json.dump({
+            "started": _started.isoformat() if _started else None,
+            "argv": sys.argv,
+            "stages": [current.to_dict() for current in get_stages()]
+        }, file, indent=2)
+        file.write("\n")
+
+
+def finish(json_path: str = None) -> None:
+    """Prints the summary and writes it to json_path, if profiling is enabled."""
+    if not is_enabled():
+        return
+    print_summary()
+    if json_path:
+        write_json(json_path)
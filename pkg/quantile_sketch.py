@@ -0,0 +1,123 @@
+from math import ceil, log
+
+# Summary of a stream of values in constant memory: count, min, max, sum and a
+# quantile sketch. The sketch puts values in logarithmic buckets (like
+# DDSketch), which bounds the relative error of every quantile by
+# relative_accuracy. Sketches with the same accuracy can be merged.
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+# Values closer to zero than this are counted as zero
+_MIN_INDEXABLE = 1e-9
+
+
+class QuantileSketch:
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("Relative accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = log(self._gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        if value > _MIN_INDEXABLE:
+            index = ceil(log(value) / self._log_gamma)
+            self.positive[index] = self.positive.get(index, 0) + 1
+        elif value < -_MIN_INDEXABLE:
+            index = ceil(log(-value) / self._log_gamma)
+            self.negative[index] = self.negative.get(index, 0) + 1
+        else:
+            self.zero_count += 1
+
+    def merge(self, other: "QuantileSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracy")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def _value(self, index: int) -> float:
+        return 2 * self._gamma ** index / (self._gamma + 1)
+
+    def value_at_rank(self, rank: int) -> float:
+        """Estimates the value at index rank of the sorted values."""
+        seen = 0
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        raise IndexError("Rank out of range")
+
+
+class ValueSummary:
+    """Exact count, min, max and average with approximate percentiles."""
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> None:
+        self.sketch = QuantileSketch(relative_accuracy)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value: float) -> None:
+        if self.count == 0:
+            self.min = self.max = value
+        elif value < self.min:
+            self.min = value
+        elif value > self.max:
+            self.max = value
+        self.count += 1
+        self.sum += value
+        self.sketch.add(value)
+
+    def merge(self, other: "ValueSummary") -> None:
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.min, self.max = other.min, other.max
+        else:
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        self.count += other.count
+        self.sum += other.sum
+        self.sketch.merge(other.sketch)
+
+    def get_avg(self) -> float:
+        return self.sum / self.count
+
+    def get_percentiles(self) -> dict:
+        """Same as pkg.statistics.get_percentiles, but approximated."""
+        if self.count == 0:
+            return {key: None for key in ["min", "p10", "p50", "p90", "p99", "max"]}
+
+        last_index = self.count - 1
+
+        def percentile(q):
+            value = self.sketch.value_at_rank(ceil(q * last_index))
+            # Estimates never exceed the exact extremes
+            return min(max(value, self.min), self.max)
+
+        return {
+            "min": self.min,
+            "p10": percentile(0.1),
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "p99": percentile(0.99),
+            "max": self.max,
+        }
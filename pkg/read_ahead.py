@@ -0,0 +1,48 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+
+# Read-ahead of files by background threads: while the contents of one file are
+# being decoded, the next ones are read already. On slow media (an SD card in a
+# card reader), reading and decoding then overlap instead of adding up. Reads
+# release the GIL, so threads are enough for that.
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_BUDGET = 256 << 20
+
+
+def _read(path: str) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def read_ahead(paths: "list[str]", depth: int, memory_budget: int = DEFAULT_MEMORY_BUDGET):
+    """
+    Yields (path, contents) for paths, in their order. Up to depth files after
+    the one being yielded are read in the background, as long as their total
+    size stays within memory_budget bytes. A single file larger than the budget
+    is still read, but only once nothing else is pending.
+    """
+    pending = deque()
+    pending_bytes = 0
+    with ThreadPoolExecutor(max_workers=depth) as pool:
+        try:
+            for path in paths:
+                size = os.path.getsize(path)
+                while pending and (len(pending) > depth or
+                                   pending_bytes + size > memory_budget):
+                    done_path, done_size, future = pending.popleft()
+                    pending_bytes -= done_size
+                    yield done_path, future.result()
+                _logger.debug("Reading ahead: %s", path)
+                pending.append((path, size, pool.submit(_read, path)))
+                pending_bytes += size
+            while pending:
+                done_path, _, future = pending.popleft()
+                yield done_path, future.result()
+        finally:
+            # Stopped early, the reads which did not start yet are not needed
+            for _, _, future in pending:
+                future.cancel()
@@ -0,0 +1,147 @@
+from array import array
+from datetime import datetime, timedelta
+
+from pkg import all_data_file
+
+# Timestamps are stored as whole minutes since EPOCH. Like the dates in
+# all-data.csv, they are in the (unknown) local time of the logger.
+EPOCH = datetime(1970, 1, 1)
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+_ONE_MINUTE = timedelta(minutes=1)
+
+
+def to_epoch_minutes(date: datetime) -> int:
+    return (date - EPOCH) // _ONE_MINUTE
+
+def from_epoch_minutes(minutes: int) -> datetime:
+    return EPOCH + timedelta(minutes=minutes)
+
+def parse_date(date: str) -> int:
+    return to_epoch_minutes(datetime.strptime(date, DATE_FORMAT))
+
+# Minutes since midnight of every valid "HH:MM"
+_DAY_MINUTES = {'{:02}:{:02}'.format(hour, minute): hour * 60 + minute
+                for hour in range(24) for minute in range(60)}
+_DAY_TIMES = sorted(_DAY_MINUTES, key=_DAY_MINUTES.get)
+
+def parse_dates(dates: "list[str]") -> "list[int]":
+    """
+    Same as parse_date for many dates at once. Only the day is parsed by
+    datetime (once per day), the time of day is looked up.
+    """
+    day_starts = {}
+    minutes = []
+    for date in dates:
+        day = date[0:10]
+        day_start = day_starts.get(day)
+        if day_start is None:
+            day_start = day_starts[day] = parse_date(day + " 00:00")
+        day_minutes = _DAY_MINUTES.get(date[11:16])
+        if day_minutes is None or len(date) != 16 or date[10] != ' ':
+            raise ValueError("Invalid date: " + date)
+        minutes.append(day_start + day_minutes)
+    return minutes
+
+def format_date(minutes: int) -> str:
+    return from_epoch_minutes(minutes).strftime(DATE_FORMAT)
+
+def format_dates(dates: "list[int]") -> "list[str]":
+    """
+    Same as format_date for many dates at once. Only the day is formatted by
+    datetime (once per day), the time of day is looked up.
+    """
+    days = {}
+    times = _DAY_TIMES
+    formatted = []
+    for date in dates:
+        day_index, day_minutes = divmod(date, 1440)
+        day = days.get(day_index)
+        if day is None:
+            day = days[day_index] = format_date(day_index * 1440)[0:11]
+        formatted.append(day + times[day_minutes])
+    return formatted
+
+# Starts of the hour, day and month of epoch minutes
+def hour_start(minutes: int) -> int:
+    return minutes - minutes % 60
+
+def day_start(minutes: int) -> int:
+    return minutes - minutes % 1440
+
+def month_start(minutes: int) -> int:
+    date = from_epoch_minutes(minutes)
+    return to_epoch_minutes(date.replace(day=1, hour=0, minute=0))
+
+def next_month_start(minutes: int) -> int:
+    date = from_epoch_minutes(month_start(minutes))
+    if date.month == 12:
+        date = date.replace(year=date.year + 1, month=1)
+    else:
+        date = date.replace(month=date.month + 1)
+    return to_epoch_minutes(date)
+
+
+class RecordTable:
+    """
+    Columnar store for the fields of all_data_file.EXPECTED_DATA_FIELDS.
+    Column i holds the field with index i (all_data_file.i_date, ...). Dates
+    are integer epoch minutes, all other fields are floats.
+    """
+
+    def __init__(self, columns: "list[array]" = None) -> None:
+        if columns is None:
+            columns = [array('q') if i == all_data_file.i_date else array('d')
+                       for i in range(len(all_data_file.EXPECTED_DATA_FIELDS))]
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns[all_data_file.i_date])
+
+    @property
+    def date(self) -> array:
+        return self.columns[all_data_file.i_date]
+
+    @property
+    def voltage(self) -> array:
+        return self.columns[all_data_file.i_voltage]
+
+    @property
+    def current(self) -> array:
+        return self.columns[all_data_file.i_current]
+
+    @property
+    def power_factor(self) -> array:
+        return self.columns[all_data_file.i_power_factor]
+
+    @property
+    def apparent_power(self) -> array:
+        return self.columns[all_data_file.i_apparent_power]
+
+    @property
+    def effective_power(self) -> array:
+        return self.columns[all_data_file.i_effective_power]
+
+    def append(self, record: list) -> None:
+        """Appends one record, with fields ordered like EXPECTED_DATA_FIELDS."""
+        for column, value in zip(self.columns, record):
+            column.append(value)
+
+    def extend_measurements(self, start: int, voltage, current, power_factor) -> None:
+        """
+        Appends records of consecutive minutes, the first one at epoch minute
+        start. Apparent and effective power are derived from the measurements.
+        """
+        self.date.extend(range(start, start + len(voltage)))
+        self.voltage.extend(voltage)
+        self.current.extend(current)
+        self.power_factor.extend(power_factor)
+        self.apparent_power.extend(v * c for v, c in zip(voltage, current))
+        self.effective_power.extend(v * c * pf for v, c, pf
+                                    in zip(voltage, current, power_factor))
+
+    def row(self, index: int) -> list:
+        return [column[index] for column in self.columns]
+
+    def slice(self, start: int, stop: int) -> "RecordTable":
+        return RecordTable([column[start:stop] for column in self.columns])
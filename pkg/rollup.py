@@ -0,0 +1,216 @@
+from array import array
+import bisect
+
+from pkg import record_table
+from pkg.record_table import RecordTable
+
+# Pre-aggregated effective power per period: hours are rolled up from the
+# minute records, days from hours and months from days. Each period holds the
+# number of minute records, the sum, min and max of their effective power [W],
+# the energy [Wh] (every record stands for one minute) and the min and max of
+# their voltage [V].
+
+FIELDS = ["date", "count", "effective_power_sum", "effective_power_min",
+          "effective_power_max", "energy_wh", "voltage_min", "voltage_max"]
+
+expected_header_line = ",".join(FIELDS) + "\n"
+
+LEVELS = ["hourly", "daily", "monthly"]
+
+
+class RollupLevel:
+    """Columns of FIELDS for consecutive periods, plus the end of each period."""
+
+    def __init__(self) -> None:
+        self.start = array('q')
+        self.end = array('q')
+        self.count = array('q')
+        self.sum = array('d')
+        self.min = array('d')
+        self.max = array('d')
+        self.energy_wh = array('d')
+        self.voltage_min = array('d')
+        self.voltage_max = array('d')
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    def append(self, start, end, count, sum, min, max, energy_wh, voltage_min,
+               voltage_max) -> None:
+        self.start.append(start)
+        self.end.append(end)
+        self.count.append(count)
+        self.sum.append(sum)
+        self.min.append(min)
+        self.max.append(max)
+        self.energy_wh.append(energy_wh)
+        self.voltage_min.append(voltage_min)
+        self.voltage_max.append(voltage_max)
+
+    def head(self, stop: int) -> "RollupLevel":
+        """Returns the periods before index stop."""
+        level = RollupLevel()
+        for name in vars(self):
+            setattr(level, name, getattr(self, name)[:stop])
+        return level
+
+    def extend(self, other: "RollupLevel") -> None:
+        for name in vars(self):
+            getattr(self, name).extend(getattr(other, name))
+
+    def get_csv_lines(self) -> "list[str]":
+        return [",".join(values) + "\n" for values in zip(
+            record_table.format_dates(self.start),
+            map(str, self.count),
+            map(str, self.sum),
+            map(str, self.min),
+            map(str, self.max),
+            map(str, self.energy_wh),
+            map(str, self.voltage_min),
+            map(str, self.voltage_max))]
+
+
+def rollup_records(records: RecordTable) -> RollupLevel:
+    """Aggregates minute records per hour."""
+    level = RollupLevel()
+    dates = records.date
+    values = records.effective_power
+    voltages = records.voltage
+    start = 0
+    while start < len(dates):
+        hour = record_table.hour_start(dates[start])
+        # Records are sorted, so the hour ends at the first later record
+        stop = bisect.bisect_left(dates, hour + 60, start)
+        hour_values = values[start:stop]
+        hour_voltages = voltages[start:stop]
+        total = sum(hour_values)
+        level.append(hour, hour + 60, stop - start, total,
+                     min(hour_values), max(hour_values), total / 60,
+                     min(hour_voltages), max(hour_voltages))
+        start = stop
+    return level
+
+
+def rollup_level(level: RollupLevel, period_start, period_end) -> RollupLevel:
+    """Aggregates the periods of a finer level into coarser periods."""
+    coarse = RollupLevel()
+    start = 0
+    while start < len(level):
+        begin = period_start(level.start[start])
+        end = period_end(begin)
+        stop = bisect.bisect_left(level.start, end, start)
+        coarse.append(begin, end,
+                      sum(level.count[start:stop]),
+                      sum(level.sum[start:stop]),
+                      min(level.min[start:stop]),
+                      max(level.max[start:stop]),
+                      sum(level.energy_wh[start:stop]),
+                      min(level.voltage_min[start:stop]),
+                      max(level.voltage_max[start:stop]))
+        start = stop
+    return coarse
+
+
+def build_pyramid(hourly: RollupLevel) -> "dict[str, RollupLevel]":
+    """Builds the coarser levels on top of an hourly level."""
+    daily = rollup_level(hourly, record_table.day_start, lambda start: start + 1440)
+    monthly = rollup_level(daily, record_table.month_start, record_table.next_month_start)
+    return {"hourly": hourly, "daily": daily, "monthly": monthly}
+
+
+def read_level(path: str, name: str) -> RollupLevel:
+    period_end = {
+        "hourly": lambda start: start + 60,
+        "daily": lambda start: start + 1440,
+        "monthly": record_table.next_month_start
+    }[name]
+    level = RollupLevel()
+    with open(path) as file:
+        header = file.readline()
+        if not header == expected_header_line:
+            raise Exception("Invalid header in rollup file: " + header)
+        for line in file:
+            date, count, *values = line.rstrip("\n").split(",")
+            start = record_table.parse_date(date)
+            level.append(start, period_end(start), int(count), *map(float, values))
+    return level
+
+
+def has_expected_header(path: str) -> bool:
+    """Tells whether a rollup file exists and has the fields of this version."""
+    try:
+        with open(path) as file:
+            return file.readline() == expected_header_line
+    except OSError:
+        return False
+
+
+def summarize(pyramid: "dict[str, RollupLevel]", start: int, end: int,
+              records: RecordTable = None) -> dict:
+    """
+    Aggregates the minutes from start until end (epoch minutes, end
+    excluded). Each part of the range is taken from the coarsest level with
+    periods completely inside it. Parts shorter than an hour are taken from
+    records if given, and skipped otherwise.
+    Returns a dict with the keys of a period: count, sum, min, max, energy_wh,
+    voltage_min, voltage_max (min and max are None without any minutes).
+    """
+    result = {"count": 0, "sum": 0.0, "min": None, "max": None, "energy_wh": 0.0,
+              "voltage_min": None, "voltage_max": None}
+
+    def add(count, sum, min_value, max_value, energy_wh, voltage_min, voltage_max):
+        if count == 0:
+            return
+        result["count"] += count
+        result["sum"] += sum
+        result["energy_wh"] += energy_wh
+        if result["min"] is None or min_value < result["min"]:
+            result["min"] = min_value
+        if result["max"] is None or max_value > result["max"]:
+            result["max"] = max_value
+        if result["voltage_min"] is None or voltage_min < result["voltage_min"]:
+            result["voltage_min"] = voltage_min
+        if result["voltage_max"] is None or voltage_max > result["voltage_max"]:
+            result["voltage_max"] = voltage_max
+
+    def add_range(levels: "list[str]", start: int, end: int):
+        if start >= end:
+            return
+        if not levels:
+            if records is not None:
+                first = bisect.bisect_left(records.date, start)
+                stop = bisect.bisect_left(records.date, end)
+                values = records.effective_power[first:stop]
+                voltages = records.voltage[first:stop]
+                if values:
+                    total = sum(values)
+                    add(len(values), total, min(values), max(values), total / 60,
+                        min(voltages), max(voltages))
+            return
+        level = pyramid[levels[0]]
+        # Periods completely within the range
+        first = bisect.bisect_left(level.start, start)
+        stop = bisect.bisect_right(level.end, end, first)
+        for i in range(first, stop):
+            add(level.count[i], level.sum[i], level.min[i], level.max[i], level.energy_wh[i],
+                level.voltage_min[i], level.voltage_max[i])
+        if first == stop:
+            add_range(levels[1:], start, end)
+        else:
+            add_range(levels[1:], start, level.start[first])
+            add_range(levels[1:], level.end[stop - 1], end)
+
+    add_range(list(reversed(LEVELS)), start, end)
+    return result
+
+
+def edge_ranges(start: int, end: int) -> "list[tuple]":
+    """
+    Returns the parts of the range from start until end which summarize takes
+    from the minute records: those before the first and after the last full hour.
+    """
+    first_hour = -(-start // 60) * 60
+    last_hour = record_table.hour_start(end)
+    if first_hour >= last_hour:
+        return [(start, end)]
+    return [(start, first_hour), (last_hour, end)]
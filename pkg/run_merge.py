@@ -0,0 +1,103 @@
+from array import array
+import heapq
+import logging
+
+from pkg import record_table
+
+# Records of dir mode which are out of order (overlapping dumps, a reset clock
+# of the logger, files renamed out of order) are put in order by a k-way merge.
+# The records between two headers are consecutive minutes, so the runs of
+# records of a dump are located and dated first, without decoding them, and
+# split into k ascending runs. Consecutive runs which are in order already
+# count as one, so a sorted dump is a single run and is decoded as usual.
+# Otherwise the runs are decoded lazily while heapq.merge takes their records
+# in order, in O(n log k) and with one decoded run of each in memory at a time.
+#
+# The dates of records before the first header of a file are inferred from the
+# file decoded before it. If such records share minutes with others, their dates
+# are wrong rather than duplicate, so that is an error whatever the policy.
+
+_logger = logging.getLogger(__name__)
+
+# What to do with a minute which occurs in more than one run: keep the record
+# of the run decoded first or last, or raise
+DUPLICATE_POLICIES = ["first", "last", "error"]
+
+# Maximum number of records of the chunks yielded by to_chunks
+BATCH_SIZE = 1 << 14
+
+
+def split_ascending(runs: list) -> "list[list]":
+    """
+    Splits runs, which have a date (of their first record) and a count of
+    records of one minute each, into lists of consecutive runs whose records
+    are in strictly ascending order.
+    """
+    groups = []
+    end = None
+    for run in runs:
+        if end is None or run.date < end:
+            groups.append([])
+        groups[-1].append(run)
+        end = run.date + run.count
+    return groups
+
+
+def merge(runs: list, duplicates: str = "first"):
+    """
+    Merges runs, iterables of (date, headerless, voltage, current,
+    power_factor) records in ascending order of date, the run decoded first
+    first. headerless tells whether the date of the record is inferred, see
+    above. Yields (date, voltage, current, power_factor) records in
+    chronological order, without duplicate minutes (see DUPLICATE_POLICIES).
+    """
+    if duplicates not in DUPLICATE_POLICIES:
+        raise ValueError("Unknown duplicate policy: " + duplicates)
+    # Run numbers break ties, so of equal dates the one decoded first comes first
+    merged = heapq.merge(*(((date, number, headerless, values)
+                            for date, headerless, *values in run)
+                           for number, run in enumerate(runs)))
+    # A record is held back until the next date shows that it is not duplicate
+    pending = None
+    dropped = 0
+    for date, _, headerless, values in merged:
+        if pending is not None and date == pending[0]:
+            if headerless or pending[1]:
+                raise Exception("Records without a header overlap others at {}, their "
+                                "dates are unknown".format(record_table.format_date(date)))
+            if duplicates == "error":
+                raise Exception("Entries are not sorted by date, {} occurs more "
+                                "than once".format(record_table.format_date(date)))
+            if duplicates == "last":
+                pending = (date, headerless, values)
+            dropped += 1
+            continue
+        if pending is not None:
+            yield (pending[0], *pending[2])
+        pending = (date, headerless, values)
+    if pending is not None:
+        yield (pending[0], *pending[2])
+    if dropped:
+        _logger.warning("Dropped %d records of duplicate minutes, keeping the %s ones",
+                        dropped, duplicates)
+
+
+def to_chunks(records, batch_size: int = BATCH_SIZE):
+    """
+    Groups (date, voltage, current, power_factor) records in chronological
+    order into chunks of consecutive minutes. Yields (date of the first record,
+    voltage, current, power_factor) with arrays of at most batch_size records.
+    """
+    start = None
+    columns = None
+    for date, *values in records:
+        if start is None or date != start + len(columns[0]) or \
+                len(columns[0]) == batch_size:
+            if start is not None:
+                yield (start, *columns)
+            start = date
+            columns = [array('d'), array('d'), array('d')]
+        for column, value in zip(columns, values):
+            column.append(value)
+    if start is not None:
+        yield (start, *columns)
@@ -0,0 +1,114 @@
+from array import array
+
+from pkg import record_table, statistics
+
+
+class SessionTable:
+    """
+    Columnar store of sessions, one typed array per field of FIELDS. Session
+    types are stored as indexes into SESSION_TYPES, start and end as epoch
+    minutes, all other fields as floats.
+    """
+
+    FIELDS = [
+        "session_type",
+        "start",
+        "end",
+        "duration_minutes",
+        "effective_power_p10",
+        "effective_power_p50",
+        "effective_power_p90",
+        "effective_power_p99",
+        "effective_power_max",
+        "effective_power_avg",
+        "voltage_min",
+        "voltage_p10",
+        "voltage_p50",
+        "voltage_p90",
+        "voltage_p99",
+        "voltage_max",
+        "voltage_avg"
+    ]
+
+    SESSION_TYPES = ["off", "on"]
+
+    # Keys of the stats dicts (see pkg.statistics) stored per measured field
+    STATS_KEYS = {
+        "effective_power": ["p10", "p50", "p90", "p99", "max", "avg"],
+        "voltage": ["min", "p10", "p50", "p90", "p99", "max", "avg"]
+    }
+
+    def __init__(self) -> None:
+        self.columns = {}
+        for name in self.FIELDS:
+            if name == "session_type":
+                self.columns[name] = array('B')
+            elif name in ("start", "end"):
+                self.columns[name] = array('q')
+            else:
+                self.columns[name] = array('d')
+        # Columns of the stats of every measured field, by key
+        self.stats_columns = {field: {key: self.columns[field + "_" + key] for key in keys}
+                              for field, keys in self.STATS_KEYS.items()}
+
+    def __len__(self) -> int:
+        return len(self.columns["session_type"])
+
+    def append(self, session_type: str, start: int, end: int,
+               effective_power_stats: dict, voltage_stats: dict) -> None:
+        """Appends a session from start to end (epoch minutes, inclusive)."""
+        columns = self.columns
+        columns["session_type"].append(self.SESSION_TYPES.index(session_type))
+        columns["start"].append(start)
+        columns["end"].append(end)
+        columns["duration_minutes"].append(float(end - start))
+        for field, stats in (("effective_power", effective_power_stats),
+                             ("voltage", voltage_stats)):
+            for key in self.STATS_KEYS[field]:
+                columns[field + "_" + key].append(stats[key])
+
+    def append_range(self, session_type: str, records: "RecordTable",
+                     start: int, stop: int) -> None:
+        """
+        Appends the session of records[start:stop], calculating the stats of
+        its records straight into the columns.
+        """
+        columns = self.columns
+        columns["session_type"].append(self.SESSION_TYPES.index(session_type))
+        columns["start"].append(records.date[start])
+        columns["end"].append(records.date[stop - 1])
+        columns["duration_minutes"].append(float(records.date[stop - 1] - records.date[start]))
+        for field, column in (("effective_power", records.effective_power),
+                              ("voltage", records.voltage)):
+            statistics.append_range_stats(column, start, stop, self.stats_columns[field])
+
+    def get_csv_header(self) -> str:
+        return ",".join(self.FIELDS) + "\n"
+
+    def _format_columns(self) -> "list[list[str]]":
+        formatted = []
+        for name in self.FIELDS:
+            column = self.columns[name]
+            if name == "session_type":
+                formatted.append([self.SESSION_TYPES[value] for value in column])
+            elif name in ("start", "end"):
+                formatted.append(record_table.format_dates(column))
+            else:
+                formatted.append(list(map(str, column)))
+        return formatted
+
+    def get_csv_lines(self) -> "list[str]":
+        """Formats all sessions at once, column by column."""
+        return [",".join(values) + "\n" for values in zip(*self._format_columns())]
+
+    def get_yaml_entries(self) -> "list[str]":
+        """Formats all sessions as entries of a YAML list."""
+        formatted = self._format_columns()
+        for name in ("session_type", "start", "end"):
+            # "on" and "off" would be booleans in YAML
+            formatted[self.FIELDS.index(name)] = ['"' + value + '"' for value
+                in formatted[self.FIELDS.index(name)]]
+        prefixes = ["- " if i == 0 else "  " for i in range(len(self.FIELDS))]
+        prefixes = [prefix + name + ": " for prefix, name in zip(prefixes, self.FIELDS)]
+        return ["".join(prefix + value + "\n" for prefix, value in zip(prefixes, values))
+                for values in zip(*formatted)]
@@ -0,0 +1,147 @@
+import sqlite3
+
+from pkg import all_data_file
+from pkg.record_table import RecordTable
+from pkg.session_table import SessionTable
+
+# SQLite copy of the data of dir mode. Every unit (info.unit_id) has its own
+# table of records "records_unit_<id>", keyed by epoch minute (the INTEGER
+# PRIMARY KEY is the rowid of SQLite, so range queries on it are indexed) with
+# the other fields of all_data_file.EXPECTED_DATA_FIELDS. Info entries of all
+# units are in table "info", sessions calculated by report.py in
+# "sessions_unit_<id>".
+
+FETCH_SIZE = 1 << 14
+
+
+def connect(path: str) -> sqlite3.Connection:
+    connection = sqlite3.connect(path)
+    # Readers are not blocked while new records are written
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("CREATE TABLE IF NOT EXISTS info ("
+                       "unit_id INTEGER, key TEXT, value TEXT, "
+                       "PRIMARY KEY (unit_id, key))")
+    return connection
+
+
+def records_table(unit_id: int) -> str:
+    return "records_unit_{}".format(int(unit_id))
+
+
+def sessions_table(unit_id: int) -> str:
+    return "sessions_unit_{}".format(int(unit_id))
+
+
+def _create_records_table(connection: sqlite3.Connection, unit_id: int) -> None:
+    fields = all_data_file.EXPECTED_DATA_FIELDS
+    columns = ['"{}" INTEGER PRIMARY KEY'.format(name) if i == all_data_file.i_date
+               else '"{}" REAL'.format(name) for i, name in enumerate(fields)]
+    connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+        records_table(unit_id), ", ".join(columns)))
+
+
+def write_unit(path: str, unit_id: int, entries: "list[dict]", records: RecordTable,
+               replace_all: bool = False) -> None:
+    """
+    Stores the info entries (dicts with key and val, see MemoryPrinter.info)
+    and records of a unit in one transaction. Existing records with the same
+    date are replaced, or all existing records of the unit if replace_all.
+    """
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute("DELETE FROM info WHERE unit_id = ?", (unit_id,))
+            connection.executemany("INSERT INTO info VALUES (?, ?, ?)",
+                                   ((unit_id, entry["key"], entry["val"])
+                                    for entry in entries))
+            if replace_all:
+                connection.execute("DROP TABLE IF EXISTS {}".format(records_table(unit_id)))
+            _create_records_table(connection, unit_id)
+            connection.executemany("INSERT OR REPLACE INTO {} VALUES ({})".format(
+                records_table(unit_id), ", ".join("?" * len(records.columns))),
+                zip(*records.columns))
+    finally:
+        connection.close()
+
+
+def get_unit_id(connection: sqlite3.Connection) -> int:
+    """Returns the unit of a database with the data of a single unit."""
+    unit_ids = [row[0] for row in connection.execute("SELECT DISTINCT unit_id FROM info")]
+    if len(unit_ids) != 1:
+        raise Exception("Expected data of one unit in the database, found: {}"
+                        .format(unit_ids))
+    return unit_ids[0]
+
+
+def read_records(path: str, start_date: int = None, end_date: int = None,
+                 unit_id: int = None) -> RecordTable:
+    """
+    Reads the records of a unit (the only one in the database by default) from
+    epoch minute start_date and before end_date, if given.
+    """
+    connection = connect(path)
+    try:
+        if unit_id is None:
+            unit_id = get_unit_id(connection)
+        date_field = all_data_file.EXPECTED_DATA_FIELDS[all_data_file.i_date]
+        conditions = []
+        parameters = []
+        if start_date is not None:
+            conditions.append("{} >= ?".format(date_field))
+            parameters.append(start_date)
+        if end_date is not None:
+            conditions.append("{} < ?".format(date_field))
+            parameters.append(end_date)
+        query = "SELECT * FROM {}".format(records_table(unit_id))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY {}".format(date_field)
+
+        records = RecordTable()
+        cursor = connection.execute(query, parameters)
+        for rows in iter(lambda: cursor.fetchmany(FETCH_SIZE), []):
+            for column, values in zip(records.columns, zip(*rows)):
+                column.extend(values)
+        return records
+    finally:
+        connection.close()
+
+
+def write_sessions(path: str, sessions: SessionTable, from_start: int = None,
+                   unit_id: int = None) -> None:
+    """
+    Stores sessions of a unit (the only one in the database by default),
+    replacing all stored sessions, or only those from epoch minute from_start.
+    """
+    connection = connect(path)
+    try:
+        if unit_id is None:
+            unit_id = get_unit_id(connection)
+        table = sessions_table(unit_id)
+        columns = []
+        for name in SessionTable.FIELDS:
+            if name == "session_type":
+                sql_type = "TEXT"
+            elif name in ("start", "end"):
+                sql_type = "INTEGER"
+            else:
+                sql_type = "REAL"
+            # Quoted, "end" is a keyword of SQL
+            columns.append('"{}" {}'.format(name, sql_type))
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS {} ({})".format(
+                table, ", ".join(columns)))
+            connection.execute("CREATE INDEX IF NOT EXISTS {0}_start ON {0} (start)"
+                               .format(table))
+            if from_start is None:
+                connection.execute("DELETE FROM {}".format(table))
+            else:
+                connection.execute("DELETE FROM {} WHERE start >= ?".format(table),
+                                   (from_start,))
+            rows = zip(*[sessions.columns[name] for name in SessionTable.FIELDS])
+            connection.executemany("INSERT INTO {} VALUES ({})".format(
+                table, ", ".join("?" * len(SessionTable.FIELDS))),
+                ((SessionTable.SESSION_TYPES[row[0]],) + row[1:] for row in rows))
+    finally:
+        connection.close()
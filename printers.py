@@ -3,8 +3,14 @@
 #
 # Copyright (C) 2014 Peter Wu <peter@lekensteyn.nl>
 
+import datetime
+import itertools
 import math
+import os
+import sys
 from defs import info, data
+from pkg import all_data_file, record_table
+from pkg.record_table import RecordTable
 
 # Python 2.7 compatibility
 if b'' == '':
@@ -13,6 +19,44 @@ if b'' == '':
 else:
     iterbytes = iter
 
+# Maximum number of lines which are formatted and written at once
+BATCH_SIZE = 1 << 14
+
+def write_lines(lines):
+    """
+    Writes lines at once to stdout, bypassing its text layer. The output is the
+    same as of print() for every line.
+    """
+    if not lines:
+        return
+    text = os.linesep.join(lines) + os.linesep
+    stream = getattr(sys.stdout, 'buffer', None)
+    if stream is None:
+        # Not a regular stdout (replaced by a StringIO for example)
+        sys.stdout.write('\n'.join(lines) + '\n')
+        return
+    # Anything printed before must come first
+    sys.stdout.flush()
+    stream.write(text.encode(sys.stdout.encoding or 'utf-8',
+                             sys.stdout.errors or 'strict'))
+
+def chunk_batches(chunk, start):
+    """
+    Splits a decoded run of records (see BasePrinter.print_data_chunk) into
+    batches of at most BATCH_SIZE records. Yields tuples of formatted dates,
+    voltage, current and power_factor.
+    """
+    first = record_table.to_epoch_minutes(start)
+    count = len(chunk.voltage)
+    for begin in range(0, count, BATCH_SIZE):
+        end = min(begin + BATCH_SIZE, count)
+        yield (record_table.format_dates(range(first + begin, first + end)),
+               chunk.voltage[begin:end], chunk.current[begin:end],
+               chunk.power_factor[begin:end])
+
+def format_column(values, format_spec):
+    return list(map(format, values, itertools.repeat(format_spec, len(values))))
+
 class BasePrinter(object):
     """Prints the info, data header or data in verbose form."""
     def __init__(self, filename):
@@ -23,6 +67,16 @@ class BasePrinter(object):
         print_namedtuple(t, data)
     def print_data(self, t, date):
         print_namedtuple(t, data)
+    def print_data_chunk(self, chunk, start):
+        """
+        Prints a decoded run of records (see pkg.data_decoder.DataChunk). The
+        first record is taken at datetime start, followed by one per minute.
+        """
+        dt = start
+        for t in zip(chunk.voltage, chunk.current, chunk.power_factor):
+            self.print_data(data.factory._make(t),
+                            date=dt.strftime('%Y-%m-%d %H:%M'))
+            dt += datetime.timedelta(minutes=1)
 
 class RawPrinter(BasePrinter):
     """Prints raw bytes in hex form, possibly with headers."""
@@ -34,6 +88,19 @@ class RawPrinter(BasePrinter):
         print(date + ' ' + ' '.join(
             ''.join('{0:02x}'.format(b) for b in iterbytes(bs))
                     for bs in all_bs))
+    def print_data_chunk(self, chunk, start):
+        offsets = []
+        offset = 0
+        for name in data.names:
+            size = data.field_structs[name].size
+            offsets.append((offset, offset + size))
+            offset += size
+        for dates, *columns in chunk_batches(chunk, start):
+            # Convert whole columns back to bytes at once
+            buf = data.pack_columns(columns)
+            write_lines([date + ' ' + ' '.join(buf[pos + begin:pos + end].hex()
+                                               for begin, end in offsets)
+                         for date, pos in zip(dates, range(0, len(buf), data.size()))])
 
 class CSVPrinter(BasePrinter):
     """Prints data separated by a semicolon."""
@@ -48,6 +115,18 @@ class CSVPrinter(BasePrinter):
             self.printed_header = True
         print('{1}{0}{2:5.1f}{0}{3:5.3f}{0}{4:5.3f}'
             .format(self.separator, date, *t))
+    def print_data_chunk(self, chunk, start):
+        for dates, voltage, current, power_factor in chunk_batches(chunk, start):
+            lines = []
+            if not self.printed_header:
+                lines.append(self.separator.join(["timestamp"] + data.names))
+                self.printed_header = True
+            # Same as print_data, but formatted column by column
+            lines.extend(map(self.separator.join, zip(dates,
+                format_column(voltage, '5.1f'),
+                format_column(current, '5.3f'),
+                format_column(power_factor, '5.3f'))))
+            write_lines(lines)
 
 class EffectivePowerPrinter(BasePrinter):
     """
@@ -61,6 +140,12 @@ class EffectivePowerPrinter(BasePrinter):
     def print_data(self, t, date):
         effective_power = t.voltage * t.current * t.power_factor
         print('{1}{0}{2:.1f}'.format(self.separator, date, effective_power))
+    def print_data_chunk(self, chunk, start):
+        for dates, voltage, current, power_factor in chunk_batches(chunk, start):
+            effective_power = [v * c * pf for v, c, pf
+                               in zip(voltage, current, power_factor)]
+            write_lines(list(map(self.separator.join, zip(dates,
+                format_column(effective_power, '.1f')))))
 
 class ApparentPowerPrinter(BasePrinter):
     """Prints the calculated apparent power in VA."""
@@ -71,12 +156,18 @@ class ApparentPowerPrinter(BasePrinter):
     def print_data(self, t, date):
         apparent_power = t.voltage * t.current
         print('{1}{0}{2:.1f}'.format(self.separator, date, apparent_power))
+    def print_data_chunk(self, chunk, start):
+        for dates, voltage, current, _ in chunk_batches(chunk, start):
+            apparent_power = [v * c for v, c in zip(voltage, current)]
+            write_lines(list(map(self.separator.join, zip(dates,
+                format_column(apparent_power, '.1f')))))
 
 class MemoryPrinter(BasePrinter):
+    """Collects info entries and data records (in a RecordTable) in memory."""
 
     def __init__(self):
         self.info = []
-        self.data = []
+        self.data = RecordTable()
         pass
     
     def print_info(self, t):
@@ -94,21 +185,54 @@ class MemoryPrinter(BasePrinter):
         pass
 
     def print_data(self, t, date):
-        # data_file_index = len(self.data) - 1
-        # if data_file_index < 0:
-        #     raise Exception("data_file_index < 0. print_data_header not called?")
+        apparent_power = t.voltage * t.current
+        effective_power = t.voltage * t.current * t.power_factor
+
+        self.data.append([
+            record_table.parse_date(date),
+            t.voltage,
+            t.current,
+            t.power_factor,
+            apparent_power,
+            effective_power
+        ])
+
+    def print_data_chunk(self, chunk, start):
+        self.data.extend_measurements(record_table.to_epoch_minutes(start),
+            chunk.voltage, chunk.current, chunk.power_factor)
+
+class AllDataCSVPrinter(MemoryPrinter):
+    """
+    Writes records to an all-data.csv file as soon as they arrive, instead of
+    keeping them in memory. Info is still kept in memory. If a
+    pkg.columnar_file.ColumnarWriter is given, chunks are written to it too.
+    """
+    def __init__(self, file, columnar_writer=None):
+        MemoryPrinter.__init__(self)
+        self.file = file
+        self.columnar_writer = columnar_writer
+        self.last_date = "1970-01-01 00:00"
+        file.write(all_data_file.expected_header_line)
+
+    def print_data_chunk(self, chunk, start):
+        # Write records one by one rather than collecting them
+        BasePrinter.print_data_chunk(self, chunk, start)
+        if self.columnar_writer:
+            self.columnar_writer.buffer().extend_measurements(
+                record_table.to_epoch_minutes(start),
+                chunk.voltage, chunk.current, chunk.power_factor)
+
+    def print_data(self, t, date):
+        # Entries must be sorted by date, which can be checked on the go
+        if date <= self.last_date:
+            raise Exception("Entries are not sorted by date!")
+        self.last_date = date
 
         apparent_power = t.voltage * t.current
         effective_power = t.voltage * t.current * t.power_factor
 
-        self.data.append({
-            "date": date,
-            "voltage": t.voltage,
-            "current": t.current,
-            "power_factor": t.power_factor,
-            "apparent_power": apparent_power,
-            "effective_power": effective_power
-        })
+        self.file.write(all_data_file.format_line(date, t.voltage, t.current,
+            t.power_factor, apparent_power, effective_power))
 
 
 def round_up(n, multiple):
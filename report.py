@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 
 from argparse import ArgumentParser
-from datetime import datetime
+import bisect
+import functools
+import json
 import logging
 import os
-
-from el4000 import ALL_DATA_RAW_FILENAME
-from pkg import all_data_file
+import sys
+
+from el4000 import ALL_DATA_RAW_FILENAME, ALL_DATA_CACHE_FILENAME, ALL_DATA_DATABASE_FILENAME, \
+    parse_time
+from pkg import all_data_file, columnar_file, energy_index, profiler, record_table, rollup, \
+    sqlite_store
+from pkg.record_table import RecordTable
+from pkg.quantile_sketch import DEFAULT_RELATIVE_ACCURACY, ValueSummary
 from pkg.statistics import get_max, get_min
-from pkg.SessionRecordWrapper import SessionRecordWrapper
+from pkg.session_table import SessionTable
 
 _logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -16,32 +23,135 @@ logging.basicConfig(level=logging.INFO)
 SIMPLE_STATS_OUTPUT_FILENAME = "simple-stats.yml"
 SESSIONS_CSV_DATA_OUTPUT_FILENAME = "sessions-data.csv"
 SESSIONS_REPORT_OUTPUT_FILENAME = "sessions-report.yml"
-
-
-def read_data(data_file_path: str):
+REPORT_CHECKPOINT_FILENAME = "report-checkpoint.json"
+ROLLUP_OUTPUT_FILENAMES = {
+    "hourly": "all-data-hourly.csv",
+    "daily": "all-data-daily.csv",
+    "monthly": "all-data-monthly.csv"
+}
+
+ENERGY_INDEX_FILENAME = "all-data.energy"
+ENERGY_OUTPUT_FILENAMES = {
+    "daily": "energy-daily.csv",
+    "monthly": "energy-monthly.csv"
+}
+ENERGY_HEADER_LINE = "date,energy_kwh,cost_tariff1,cost_tariff2\n"
+INFO_FILENAME = "info.yml"
+TARIFFS = ["tariff1", "tariff2"]
+
+READ_BLOCK_SIZE = 1 << 22
+
+
+def read_data(data_file_path: str, cache_file_path: str = None, start_date: int = None,
+              end_date: int = None, database_path: str = None):
+    """
+    Reads all records, or only those from epoch minute start_date onwards and
+    before end_date. Only the records of the range are read: the blocks of the
+    columnar file which overlap it, the byte range of the CSV file found by
+    binary search, or an indexed query if database_path is given.
+    """
+    if database_path:
+        _logger.info("Reading data from {}...".format(database_path))
+        return sqlite_store.read_records(database_path, start_date, end_date)
+    if cache_file_path and columnar_file.is_up_to_date(cache_file_path, data_file_path):
+        _logger.info("Reading columnar data from {}...".format(cache_file_path))
+        if start_date is not None or end_date is not None:
+            return columnar_file.read_range(cache_file_path, start_date, end_date)
+        return columnar_file.read_table(cache_file_path)
+    return read_csv_data(data_file_path, start_date, end_date)
+
+
+def read_csv_data(data_file_path: str, start_date: int = None, end_date: int = None):
+    field_count = len(all_data_file.EXPECTED_DATA_FIELDS)
     with open(data_file_path) as file:
         header = file.readline()
         if not header == all_data_file.expected_header_line:
             raise Exception("Invalid header in data file: " + header)
-
-        records = []
-        for line in file:
-            fields = line.strip().split(",")
-            if len(fields) != 6:
-                raise Exception("Invalid number of fields in data: " + len(fields))
-
-            record = [None] * len(all_data_file.EXPECTED_DATA_FIELDS)
-            
-            record[all_data_file.i_date] = datetime.strptime(fields[all_data_file.i_date], '%Y-%m-%d %H:%M')
-            record[all_data_file.i_voltage] = float(fields[all_data_file.i_voltage])
-            record[all_data_file.i_current] = float(fields[all_data_file.i_current])
-            record[all_data_file.i_power_factor] = float(fields[all_data_file.i_power_factor])
-            record[all_data_file.i_apparent_power] = float(fields[all_data_file.i_apparent_power])
-            record[all_data_file.i_effective_power] = float(fields[all_data_file.i_effective_power])
-            
-            records.append(record)
+        start = file.tell()
+        if start_date is not None:
+            start = _find_csv_offset(data_file_path, start_date)
+            file.seek(start)
+        # Number of bytes (all ASCII) until the end of the range
+        remaining = None
+        if end_date is not None:
+            remaining = max(0, _find_csv_offset(data_file_path, end_date) - start)
+
+        records = RecordTable()
+        # The file is read in large blocks of whole lines. All fields of a block
+        # are split at once and then converted column by column.
+        remainder = ""
+        while True:
+            if remaining is None:
+                block = file.read(READ_BLOCK_SIZE)
+            else:
+                block = file.read(min(READ_BLOCK_SIZE, remaining))
+                remaining -= len(block)
+            if not block:
+                break
+            block = remainder + block
+            end = block.rfind("\n") + 1
+            block, remainder = block[:end], block[end:]
+            _parse_csv_block(block, records, field_count)
+        _parse_csv_block(remainder, records, field_count)
 
         return records
+
+
+def _find_csv_offset(data_file_path: str, date: int) -> int:
+    """
+    Returns the offset of the first line in a sorted all-data.csv file (or
+    another file with such dates first) with a date not before date, using
+    binary search over the file contents.
+    """
+    def line_date(line: bytes) -> int:
+        return record_table.parse_date(line[0:16].decode())
+
+    with open(data_file_path, 'rb') as file:
+        # Lines before lo are older than date, the searched line starts at hi
+        # at the latest (hi may also be the end of the file).
+        lo = len(file.readline())
+        hi = file.seek(0, os.SEEK_END)
+        while lo < hi:
+            file.seek((lo + hi) // 2)
+            file.readline()
+            line_start = file.tell()
+            if line_start >= hi:
+                break
+            line = file.readline()
+            if line_date(line) >= date:
+                hi = line_start
+            else:
+                lo = line_start + len(line)
+
+        # Few lines are left between lo and hi, check them one by one
+        file.seek(lo)
+        while lo < hi:
+            line = file.readline()
+            if line_date(line) >= date:
+                break
+            lo += len(line)
+        return lo
+
+
+def _parse_csv_block(block: str, records: RecordTable, field_count: int):
+    line_count = block.count("\n")
+    if block and not block.endswith("\n"):
+        line_count += 1
+    if line_count == 0:
+        return
+
+    fields = block.rstrip("\n").replace("\n", ",").split(",")
+    if len(fields) != line_count * field_count:
+        raise Exception("Invalid number of fields in data: {} fields in {} lines"
+                        .format(len(fields), line_count))
+
+    for i, column in enumerate(records.columns):
+        values = fields[i::field_count]
+        if i == all_data_file.i_date:
+            # Misplaced fields would end up here and fail to parse as dates
+            column.extend(record_table.parse_dates(values))
+        else:
+            column.extend(map(float, values))
    
 
 def get_max_voltage(records):
@@ -54,83 +164,558 @@ def get_max_effective_power(records):
     return get_max(records, all_data_file.i_effective_power)
 
 
-def write_simple_stats_file(all_data, dir):
-    with open(os.path.join(dir, SIMPLE_STATS_OUTPUT_FILENAME), 'x') as file:
-        file.write("max effective power [W]: {}\n".format(get_max_effective_power(all_data)))
-        file.write("min voltage [V]: {}\n".format(get_min_voltage(all_data)))
-        file.write("max voltage [V]: {}\n".format(get_max_voltage(all_data)))
-    _logger.info("{} file written".format(SIMPLE_STATS_OUTPUT_FILENAME))
+def calculate_simple_stats(all_data) -> dict:
+    return {
+        "max_effective_power": get_max_effective_power(all_data),
+        "min_voltage": get_min_voltage(all_data),
+        "max_voltage": get_max_voltage(all_data)
+    }
 
 
+def merge_simple_stats(stats: dict, new_stats: dict) -> dict:
+    """Combines the stats of two (possibly overlapping) ranges of data."""
+    def merge(function, a, b):
+        if a is None or b is None:
+            return b if a is None else a
+        return function(a, b)
 
-def calculate_sessions_data(all_data: "list[list]", srw: "SessionRecordWrapper"):
-    session_min_power = 10
+    return {
+        "max_effective_power": merge(max, stats["max_effective_power"], new_stats["max_effective_power"]),
+        "min_voltage": merge(min, stats["min_voltage"], new_stats["min_voltage"]),
+        "max_voltage": merge(max, stats["max_voltage"], new_stats["max_voltage"])
+    }
 
-    sessions_records = []
 
-    current_session_records = []
+def write_simple_stats_file(all_data, dir, stats: dict = None, mode: str = 'x'):
+    if stats is None:
+        stats = calculate_simple_stats(all_data)
+    with open(os.path.join(dir, SIMPLE_STATS_OUTPUT_FILENAME), mode) as file:
+        file.write("max effective power [W]: {}\n".format(stats["max_effective_power"]))
+        file.write("min voltage [V]: {}\n".format(stats["min_voltage"]))
+        file.write("max voltage [V]: {}\n".format(stats["max_voltage"]))
+    _logger.info("{} file written".format(SIMPLE_STATS_OUTPUT_FILENAME))
+
+
+def rollups_are_up_to_date(dir: str, data_file_path: str) -> bool:
+    """Tells whether all rollup files are there, current and not older than the data."""
+    for filename in ROLLUP_OUTPUT_FILENAMES.values():
+        path = os.path.join(dir, filename)
+        if not rollup.has_expected_header(path) or \
+                not columnar_file.is_up_to_date(path, data_file_path):
+            return False
+    return True
+
+
+def read_pyramid(dir: str) -> "dict[str, rollup.RollupLevel]":
+    return {name: rollup.read_level(os.path.join(dir, ROLLUP_OUTPUT_FILENAMES[name]), name)
+            for name in rollup.LEVELS}
+
+
+def summarize_range(pyramid: "dict[str, rollup.RollupLevel]", read_records,
+                    start_date: int = None, end_date: int = None) -> dict:
+    """
+    Returns the number of records, energy and simple stats of a time range,
+    taken from the periods of pyramid within it. Only the minutes before its
+    first and after its last full hour are read, with read_records(start, end).
+    """
+    hourly = pyramid["hourly"]
+    if len(hourly) == 0:
+        return summarize_records(RecordTable())
+    start = hourly.start[0] if start_date is None else start_date
+    end = hourly.end[-1] if end_date is None else end_date
+    records = RecordTable()
+    if start < end:
+        for edge_start, edge_end in rollup.edge_ranges(start, end):
+            if edge_start < edge_end:
+                edge = read_records(edge_start, edge_end)
+                for column, edge_column in zip(records.columns, edge.columns):
+                    column.extend(edge_column)
+    summary = rollup.summarize(pyramid, start, end, records)
+    return {
+        "records": summary["count"],
+        "energy_wh": summary["energy_wh"],
+        "max_effective_power": summary["max"],
+        "min_voltage": summary["voltage_min"],
+        "max_voltage": summary["voltage_max"]
+    }
+
+
+def summarize_records(all_data: "RecordTable") -> dict:
+    """Same as summarize_range, from all records of the range."""
+    summary = calculate_simple_stats(all_data)
+    summary["records"] = len(all_data)
+    summary["energy_wh"] = sum(all_data.effective_power) / 60
+    return summary
+
+
+def print_range_report(summary: dict, start_date: int = None, end_date: int = None,
+                       tariffs: dict = None):
+    """Prints the stats and energy of a time range, see summarize_range."""
+    print_range_header(start_date, end_date)
+    print("records: {}".format(summary["records"]))
+    print_energy(summary["energy_wh"], tariffs)
+    print("max effective power [W]: {}".format(summary["max_effective_power"]))
+    print("min voltage [V]: {}".format(summary["min_voltage"]))
+    print("max voltage [V]: {}".format(summary["max_voltage"]))
+
+
+def print_range_header(start_date: int = None, end_date: int = None):
+    if start_date is not None:
+        print("from: \"{}\"".format(record_table.format_date(start_date)))
+    if end_date is not None:
+        print("to: \"{}\"".format(record_table.format_date(end_date)))
+
+
+def print_energy(energy_wh: float, tariffs: dict = None):
+    print("energy [Wh]: {}".format(energy_wh))
+    for name, tariff in (tariffs or {}).items():
+        print("cost at {}: {}".format(name, energy_wh / 1000 * tariff))
+
+
+def read_tariffs(dir: str) -> dict:
+    """Returns the tariffs per kWh found in the info file of dir, by name."""
+    tariffs = {}
+    path = os.path.join(dir, INFO_FILENAME)
+    if not os.path.exists(path):
+        return tariffs
+    with open(path) as file:
+        for line in file:
+            key, _, value = line.partition(":")
+            if key.strip() in TARIFFS:
+                tariffs[key.strip()] = float(value)
+    return tariffs
+
+
+def write_energy(all_data: "RecordTable", dir: str, tariffs: dict, mode: str = 'x',
+                 append: bool = False):
+    """
+    Writes the energy index and the daily and monthly energy files. If append
+    is set, the records in the index from the first one of all_data on are
+    replaced, and only the days and months from there on are written again.
+    """
+    _logger.info("Calculating energy index...")
+    index_filepath = os.path.join(dir, ENERGY_INDEX_FILENAME)
+    if append and len(all_data) > 0 and os.path.exists(index_filepath):
+        energy_index.append_index(index_filepath, all_data)
+        _logger.info("{} file written".format(ENERGY_INDEX_FILENAME))
+        # The periods from the first new record on are looked up in the file
+        with energy_index.open_index(index_filepath) as index:
+            write_energy_files(index, dir, tariffs, mode, all_data.date[0])
+    else:
+        index = energy_index.EnergyIndex()
+        index.extend(all_data)
+        energy_index.write_index(index_filepath, index)
+        _logger.info("{} file written".format(ENERGY_INDEX_FILENAME))
+        write_energy_files(index, dir, tariffs, mode)
+
+
+def write_energy_files(index: "energy_index.EnergyIndex", dir: str, tariffs: dict, mode: str,
+                       start_date: int = None):
+    """
+    Writes the daily and monthly energy files. If start_date is given, only
+    the periods from the one of start_date on are written again.
+    """
+    for name, periods, period_start in (("daily", index.daily, record_table.day_start),
+                                        ("monthly", index.monthly, record_table.month_start)):
+        filepath = os.path.join(dir, ENERGY_OUTPUT_FILENAMES[name])
+        offset = None
+        if start_date is not None:
+            offset = _find_csv_offset(filepath, period_start(start_date))
+        entries = []
+        for start, energy_wh in periods(start_date):
+            costs = [str(energy_wh / 1000 * tariffs[tariff]) if tariff in tariffs else ""
+                     for tariff in TARIFFS]
+            entries.append(",".join([record_table.format_date(start),
+                                     str(energy_wh / 1000)] + costs) + "\n")
+        _write_entries(filepath, ENERGY_HEADER_LINE, entries, mode, offset)
+        _logger.info("{} file written".format(ENERGY_OUTPUT_FILENAMES[name]))
+
+
+SESSION_MIN_POWER = 10
+
+def get_session_type(effective_power: float):
+    if effective_power >= SESSION_MIN_POWER:
+        return "on"
+    else:
+        return "off"
+
+
+def calculate_sessions_data(all_data: "RecordTable") -> SessionTable:
+    # Sessions are tracked as ranges of record indices, the stats of each are
+    # written to the table as soon as it ends
+    sessions = SessionTable()
+
     session_start = None
-    session_end = None
     last_session_type = None
-    
-    def get_session_type(record: list):
-        if record[all_data_file.i_effective_power] >= session_min_power:
-            return "on"
-        else:
-            return "off"
-
-    def end_session(session_type, session_start, session_end, session_records):
-        if session_type == None: return
-        srw.create(session_type, session_start, session_end, current_session_records)
-        sessions_records.append(srw.unwrap())
 
-    for record in all_data:
-        session_type = get_session_type(record)
+    for index, effective_power in enumerate(all_data.effective_power):
+        session_type = get_session_type(effective_power)
 
         if session_type != last_session_type:
-            end_session(last_session_type, session_start, session_end, current_session_records)
-            session_start = record[all_data_file.i_date]
-            current_session_records = []
+            if last_session_type != None:
+                sessions.append_range(last_session_type, all_data, session_start, index)
+            session_start = index
 
         last_session_type = session_type
-        session_end = record[all_data_file.i_date]
-        current_session_records.append(record)
 
-    end_session(last_session_type, session_start, session_end, current_session_records)
-    return sessions_records
+    if last_session_type != None:
+        sessions.append_range(last_session_type, all_data, session_start, len(all_data))
+    return sessions
+
+
+def calculate_sessions_data_sketched(all_data: "RecordTable",
+                                     relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY) -> SessionTable:
+    """
+    Same as calculate_sessions_data, but sessions are summarized while records
+    stream by, in memory independent of the length of a session. Percentiles
+    other than min and max are approximated within relative_accuracy.
+    """
+    sessions = SessionTable()
+
+    last_session_type = None
+    session_start = None
+    session_end = None
+    effective_power_summary = None
+    voltage_summary = None
 
+    def summary_stats(summary: ValueSummary) -> dict:
+        stats = summary.get_percentiles()
+        stats["avg"] = summary.get_avg()
+        return stats
 
-def write_sessions(all_data: "list[list]", dir: str):
+    def end_session():
+        if last_session_type == None: return
+        sessions.append(last_session_type, session_start, session_end,
+                        summary_stats(effective_power_summary),
+                        summary_stats(voltage_summary))
+
+    for date, voltage, effective_power in zip(all_data.date, all_data.voltage, all_data.effective_power):
+        session_type = get_session_type(effective_power)
+
+        if session_type != last_session_type:
+            end_session()
+            session_start = date
+            effective_power_summary = ValueSummary(relative_accuracy)
+            voltage_summary = ValueSummary(relative_accuracy)
+
+        last_session_type = session_type
+        session_end = date
+        effective_power_summary.add(effective_power)
+        voltage_summary.add(voltage)
+
+    end_session()
+    return sessions
+
+
+def write_rollups(all_data: "RecordTable", dir: str, mode: str = 'x', append: bool = False):
+    """
+    Writes the hourly, daily and monthly rollup files. If append is set, the
+    hours of all_data replace those from its first hour on in the existing
+    hourly file, and the coarser levels are built again from there.
+    all_data then has to start at a full hour.
+    """
+    _logger.info("Calculating rollups...")
+    hourly = rollup.rollup_records(all_data)
+    hourly_filepath = os.path.join(dir, ROLLUP_OUTPUT_FILENAMES["hourly"])
+    if append and os.path.exists(hourly_filepath):
+        old_hourly = rollup.read_level(hourly_filepath, "hourly")
+        if len(hourly):
+            old_hourly = old_hourly.head(bisect.bisect_left(old_hourly.start, hourly.start[0]))
+        old_hourly.extend(hourly)
+        hourly = old_hourly
+
+    pyramid = rollup.build_pyramid(hourly)
+    for name in rollup.LEVELS:
+        filename = ROLLUP_OUTPUT_FILENAMES[name]
+        with open(os.path.join(dir, filename), mode) as file:
+            file.write(rollup.expected_header_line)
+            file.writelines(pyramid[name].get_csv_lines())
+        _logger.info("{} file written".format(filename))
+    return pyramid
+
+
+def _write_entries(path: str, header: str, entries: "list[str]", mode: str, offset: int) -> int:
+    """
+    Writes header and entries to a file. If offset is given, the existing file
+    is truncated at offset and only the entries are written from there.
+    Returns the offset of the last entry (None if there are no entries).
+    """
+    with open(path, mode if offset is None else 'r+') as file:
+        if offset is None:
+            file.write(header)
+        else:
+            file.seek(offset)
+            file.truncate()
+        file.writelines(entries[:-1])
+        if not entries:
+            return None
+        last_offset = file.tell()
+        file.write(entries[-1])
+        return last_offset
+
+
+def write_sessions(all_data: "RecordTable", dir: str, mode: str = 'x', offsets: "list[int]" = None,
+                   calculate_sessions=calculate_sessions_data, database_path: str = None):
+    """
+    Writes the sessions data file and the sessions report, and stores the
+    sessions in the database if database_path is given. If offsets are given,
+    the existing files are truncated at these offsets and the sessions are
+    written from there (in the database, from the start of all_data).
+    Returns the start date of the last session and the offsets of its entries
+    (None if there are no sessions), that session may continue in later data.
+    """
     _logger.info("Calculating sessions data...")
-    srw = SessionRecordWrapper()
-    sessions_data = calculate_sessions_data(all_data, srw)
+    sessions = calculate_sessions(all_data)
+    if database_path:
+        _logger.info("Writing sessions to {}...".format(database_path))
+        sqlite_store.write_sessions(database_path, sessions,
+                                    all_data.date[0] if offsets and len(all_data) else None)
+    if offsets is None:
+        offsets = [None, None]
+
     _logger.info("Writing sessions data to {}...".format(SESSIONS_CSV_DATA_OUTPUT_FILENAME))
-    with open(os.path.join(dir, SESSIONS_CSV_DATA_OUTPUT_FILENAME), 'x') as file:
-        file.write(srw.get_csv_header())
-        for session in sessions_data:
-            srw.wrap(session)
-            file.write(srw.get_as_csv_data_line())
+    csv_offset = _write_entries(os.path.join(dir, SESSIONS_CSV_DATA_OUTPUT_FILENAME),
+                                sessions.get_csv_header(), sessions.get_csv_lines(),
+                                mode, offsets[0])
     _logger.info("File {} written".format(SESSIONS_CSV_DATA_OUTPUT_FILENAME))
 
+    _logger.info("Writing sessions report to {}...".format(SESSIONS_REPORT_OUTPUT_FILENAME))
+    report_offset = _write_entries(os.path.join(dir, SESSIONS_REPORT_OUTPUT_FILENAME),
+                                   "", sessions.get_yaml_entries(), mode, offsets[1])
+    _logger.info("File {} written".format(SESSIONS_REPORT_OUTPUT_FILENAME))
+
+    if len(sessions) == 0:
+        return None
+    return sessions.columns["start"][-1], [csv_offset, report_offset]
+
+
+def run_incremental_report(dir: str, all_data_filepath: str, cache_filepath: str,
+                           calculate_sessions=calculate_sessions_data, database_path: str = None):
+    """
+    Updates the stats and sessions files with data added since the last run,
+    using the state saved in the checkpoint file. Data is assumed to be only
+    appended in between (like el4000.py --dir --incremental does).
+    """
+    checkpoint_filepath = os.path.join(dir, REPORT_CHECKPOINT_FILENAME)
+    checkpoint = read_checkpoint(checkpoint_filepath)
+    output_filenames = [SESSIONS_CSV_DATA_OUTPUT_FILENAME, SESSIONS_REPORT_OUTPUT_FILENAME,
+                        ROLLUP_OUTPUT_FILENAMES["hourly"], ENERGY_INDEX_FILENAME,
+                        *ENERGY_OUTPUT_FILENAMES.values()]
+    if checkpoint and not all(os.path.exists(os.path.join(dir, filename))
+                              for filename in output_filenames):
+        checkpoint = None
+    if checkpoint and not rollup.has_expected_header(
+            os.path.join(dir, ROLLUP_OUTPUT_FILENAMES["hourly"])):
+        _logger.warning("Rollups have fields of an older version, processing all data")
+        checkpoint = None
+    if checkpoint and not energy_index.has_expected_magic(
+            os.path.join(dir, ENERGY_INDEX_FILENAME)):
+        _logger.warning("Energy index has an older layout, processing all data")
+        checkpoint = None
+
+    if checkpoint:
+        # The last session may continue, so it is calculated again from its
+        # start. Rollups are calculated again from the start of its hour.
+        start_date = checkpoint["open_session_start"]
+        _logger.info("Reading data since {}...".format(record_table.format_date(start_date)))
+        with profiler.stage("read") as stage:
+            all_data = read_data(all_data_filepath, cache_filepath, start_date - start_date % 60,
+                                 database_path=database_path)
+            stage.records = len(all_data)
+        session_data = all_data.slice(bisect.bisect_left(all_data.date, start_date), len(all_data))
+        if len(session_data) == 0 or session_data.date[0] != start_date:
+            _logger.warning("Data does not match the checkpoint, processing all data")
+            checkpoint = None
+        elif all_data.date[-1] == checkpoint["last_date"]:
+            _logger.info("No new data since the last run")
+            return
+
+    if not checkpoint:
+        with profiler.stage("read") as stage:
+            all_data = session_data = read_data(all_data_filepath, cache_filepath,
+                                                database_path=database_path)
+            stage.records = len(all_data)
+    _logger.info("Read data: {} entries".format(len(all_data)))
+    if len(all_data) == 0:
+        return
+
+    with profiler.stage("stats") as stage:
+        stage.records = len(all_data)
+        stats = calculate_simple_stats(all_data)
+        if checkpoint:
+            stats = merge_simple_stats(checkpoint["simple_stats"], stats)
+        write_simple_stats_file(all_data, dir, stats, 'w')
+
+    with profiler.stage("sessions") as stage:
+        stage.records = len(session_data)
+        if checkpoint:
+            open_session = write_sessions(session_data, dir,
+                                          offsets=checkpoint["open_session_offsets"],
+                                          calculate_sessions=calculate_sessions,
+                                          database_path=database_path)
+        else:
+            open_session = write_sessions(session_data, dir, 'w',
+                                          calculate_sessions=calculate_sessions,
+                                          database_path=database_path)
+
+    with profiler.stage("rollups") as stage:
+        stage.records = len(all_data)
+        write_rollups(all_data, dir, 'w', append=bool(checkpoint))
+
+    with profiler.stage("energy") as stage:
+        stage.records = len(all_data)
+        write_energy(all_data, dir, read_tariffs(dir), 'w', append=bool(checkpoint))
+
+    write_checkpoint(checkpoint_filepath, {
+        "last_date": all_data.date[-1],
+        "simple_stats": stats,
+        "open_session_start": open_session[0],
+        "open_session_offsets": open_session[1]
+    })
+
+
+def read_checkpoint(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_checkpoint(path: str, checkpoint: dict):
+    with open(path + ".tmp", 'w') as file:
+        json.dump(checkpoint, file, indent=2, sort_keys=True)
+        file.write("\n")
+    os.replace(path + ".tmp", path)
+    _logger.info("{} file written".format(os.path.basename(path)))
+
 
 
 parser = ArgumentParser(description='Energy Logger 4000 report from data. \
     Run only after running el4000.py --dir <directory>.')
 
+parser.add_argument('--incremental', action='store_true',
+                    help='only process data added since the last run with this option, \
+                    using the state saved in {}'.format(REPORT_CHECKPOINT_FILENAME))
+parser.add_argument('--sessions-mode', choices=['exact', 'sketch'], default='exact',
+                    help="how session percentiles are calculated: 'exact' sorts the records \
+                    of every session, 'sketch' approximates them in constant memory \
+                    (default '%(default)s')")
+parser.add_argument('--sketch-accuracy', type=float, default=DEFAULT_RELATIVE_ACCURACY,
+                    help='relative accuracy of percentiles in sketch mode (default %(default)s)')
+parser.add_argument('--from', dest='start', type=parse_time, metavar='DATE',
+                    help="only print stats of the records from DATE ('YYYY-MM-DD' or \
+                    'YYYY-MM-DD HH:MM') to stdout, no files are written")
+parser.add_argument('--to', dest='end', type=parse_time, metavar='DATE',
+                    help='only print stats of the records before DATE, see --from')
+parser.add_argument('--energy', action='store_true',
+                    help='with --from and/or --to, only print the energy and cost of the range, \
+                    looked up in {} (written by every other run) without reading the data'
+                    .format(ENERGY_INDEX_FILENAME))
+parser.add_argument('--sqlite', action='store_true',
+                    help='read data from {} (written by el4000.py --dir --sqlite) instead of \
+                    the data files, and store the sessions there too'
+                    .format(ALL_DATA_DATABASE_FILENAME))
+parser.add_argument('--profile', action='store_true',
+                    help='print wall time, CPU time, records and peak memory growth of every \
+                    stage to stderr when done')
+parser.add_argument('--profile-json', metavar='FILE',
+                    help='also write the --profile results to FILE as JSON (implies --profile)')
 parser.add_argument('dir', metavar='data_dir',
                     help='directory with data. It searches for files generated by el4000.py --dir <data_dir>')
 
 if __name__ == '__main__':
     args = parser.parse_args()
+    if args.profile or args.profile_json:
+        profiler.enable()
 
     if not os.path.isdir(args.dir):
         raise Exception("Directory '{}' does not exist")
 
     all_data_filepath = os.path.join(args.dir, ALL_DATA_RAW_FILENAME)
+    cache_filepath = os.path.join(args.dir, ALL_DATA_CACHE_FILENAME)
+    if args.sessions_mode == 'sketch':
+        calculate_sessions = functools.partial(calculate_sessions_data_sketched,
+                                               relative_accuracy=args.sketch_accuracy)
+    else:
+        calculate_sessions = calculate_sessions_data
+    database_path = None
+    if args.sqlite:
+        database_path = os.path.join(args.dir, ALL_DATA_DATABASE_FILENAME)
+        if not os.path.exists(database_path):
+            parser.error("Database '{}' does not exist".format(database_path))
+
+    if args.energy and args.start is None and args.end is None:
+        parser.error("--energy requires --from and/or --to")
+    if args.start is not None or args.end is not None:
+        if args.incremental:
+            parser.error("--from and --to cannot be used with --incremental")
+        # The energy index is only used as long as it is not older than the data
+        index_filepath = os.path.join(args.dir, ENERGY_INDEX_FILENAME)
+        energy_wh = None
+        if columnar_file.is_up_to_date(index_filepath, database_path or all_data_filepath):
+            with profiler.stage("read energy index"), \
+                 energy_index.open_index(index_filepath) as index:
+                energy_wh = index.energy_wh(args.start, args.end)
+        elif args.energy:
+            parser.error("Energy index '{}' is missing or outdated, run report.py first"
+                         .format(index_filepath))
+        tariffs = read_tariffs(args.dir)
+        if args.energy:
+            print_range_header(args.start, args.end)
+            print_energy(energy_wh, tariffs)
+            profiler.finish(args.profile_json)
+            sys.exit(0)
+
+        if rollups_are_up_to_date(args.dir, database_path or all_data_filepath):
+            # Full hours, days and months are taken from the rollups
+            with profiler.stage("read rollups") as stage:
+                pyramid = read_pyramid(args.dir)
+                stage.records = len(pyramid["hourly"])
+            with profiler.stage("stats") as stage:
+                summary = summarize_range(
+                    pyramid, lambda start, end: read_data(all_data_filepath, cache_filepath,
+                                                          start, end, database_path),
+                    args.start, args.end)
+                stage.records = summary["records"]
+        else:
+            with profiler.stage("read") as stage:
+                all_data = read_data(all_data_filepath, cache_filepath, args.start, args.end,
+                                     database_path)
+                stage.records = len(all_data)
+            _logger.info("Read data of range: {} entries".format(len(all_data)))
+            with profiler.stage("stats") as stage:
+                stage.records = len(all_data)
+                summary = summarize_records(all_data)
+        if energy_wh is not None:
+            summary["energy_wh"] = energy_wh
+        print_range_report(summary, args.start, args.end, tariffs)
+        profiler.finish(args.profile_json)
+        sys.exit(0)
+
+    if args.incremental:
+        run_incremental_report(args.dir, all_data_filepath, cache_filepath, calculate_sessions,
+                               database_path)
+        profiler.finish(args.profile_json)
+        sys.exit(0)
+
     _logger.info("Reading file {}...".format(ALL_DATA_RAW_FILENAME))
-    all_data = read_data(all_data_filepath)
+    with profiler.stage("read") as stage:
+        all_data = read_data(all_data_filepath, cache_filepath, database_path=database_path)
+        stage.records = len(all_data)
     _logger.info("Read all data: {} entries".format(len(all_data)))
-    write_simple_stats_file(all_data, args.dir)
-    write_sessions(all_data, args.dir)
+    with profiler.stage("stats") as stage:
+        stage.records = len(all_data)
+        write_simple_stats_file(all_data, args.dir)
+    with profiler.stage("sessions") as stage:
+        stage.records = len(all_data)
+        write_sessions(all_data, args.dir, calculate_sessions=calculate_sessions,
+                       database_path=database_path)
+    with profiler.stage("rollups") as stage:
+        stage.records = len(all_data)
+        write_rollups(all_data, args.dir)
+    with profiler.stage("energy") as stage:
+        stage.records = len(all_data)
+        write_energy(all_data, args.dir, read_tariffs(args.dir))
+    profiler.finish(args.profile_json)
     
         
\ No newline at end of file